@@ -1,61 +1,190 @@
-import inspect, dis, ast, re, textwrap
+import inspect, dis, ast, re, os, io
+from array import array
+from collections import OrderedDict
+from functools import cache
 from dis import Instruction
 from typing import Callable
-from types import FunctionType, MethodType, CodeType
+from types import FunctionType, MethodType, CodeType, ModuleType
 
-__all__ = "Analyser", "analyse"
+__all__ = "Analyser", "analyse", "analyse_module", "analysis", "analysis_key", "code_digest", "source_tree", "code_objects", "line_table", "flat_tables"
+
+# Analyses kept in memory, least recently used first.
+CACHE_SIZE = 512
+_analyses: OrderedDict[tuple[str, str, int, str], dict] = OrderedDict()
+
+# Directory of the on-disk analysis cache, or None to keep analyses in memory only.
+cache_directory: str | None = os.environ.get("PYRFTESTER_ANALYSIS_CACHE")
+
+# Modules only the disk cache, digests and warm-up need are imported by the functions that use them, which keeps importing the analyser cheap.
+
+@cache
+def _dispatch_table() -> dict:
+    """Instructions refer to nested code objects in their arguments, which pickle cannot store by itself."""
+    import copyreg, marshal
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[CodeType] = lambda code: (marshal.loads, (marshal.dumps(code),))
+    return dispatch_table
 
 class Analyser[**ARGS, RET](Callable):
     """
-    Break
+    Break a function down into its source lines and the bytecode instructions of each line.
+    Every derived artefact is computed on first access, so wrapping a function only costs a few attribute stores.
     """
     __slots__ = (
         "function",
-        "bytecode",
-        "lines",
-        "ast",
-        "reduced_code",
-        "overview"
+        "_bytecode",
+        "_shared",
+        "_lines",
+        "_overview",
+        "_specialisation"
     )
 
     def __init__(self, code_object: MethodType | FunctionType | CodeType | type) -> None:
 
         self.function: FunctionType = code_object
-        self.bytecode: dis.Bytecode = dis.Bytecode(code_object)
-        self.lines: dict[int, dict[str, str | list[dis.Instruction]]] = {}
-        self.ast: ast.Module = ast.parse(textwrap.dedent(inspect.getsource(code_object)), inspect.getabsfile(code_object), optimize = 0)
-        self.reduced_code: str = re.sub("\n\n+", "\n", ast.unparse(self.ast))
-
-        # Wonky workaround to map the original line numbers to the reduced ones.
-        line_mapping: dict[int, int] = {}
-        start_line_number = inspect.getsourcelines(code_object)[1]
-        for i, j in zip(ast.walk(self.ast), ast.walk(ast.parse(self.reduced_code, inspect.getabsfile(code_object), optimize = 0))):
-            if hasattr(i, "lineno") and hasattr(j, "lineno"):
-                line_mapping[i.lineno + start_line_number - 1] = j.lineno + start_line_number - 1
-
-
-        # Fill the lines dict with info.
-        code_lines = self.reduced_code.splitlines()
-        for instruction in self.bytecode:
+        self._bytecode: dis.Bytecode | None = None
+        self._shared: dict | None = None
+        self._lines: dict[int, dict[str, str | list[dis.Instruction]]] | None = None
+        self._overview: str | None = None
+        self._specialisation: dict[int, dict[str, list[str]]] | None = None
+
+    @property
+    def bytecode(self) -> dis.Bytecode:
+        if self._bytecode is None:
+            self._bytecode = dis.Bytecode(self.function)
+        return self._bytecode
+
+    @property
+    def shared(self) -> dict:
+        """The disassembly, AST and line mapping, shared with every other Analyser and Profiler of the same code."""
+        if self._shared is None:
+            self._shared = analysis(self.bytecode.codeobj, source = True)
+        return self._shared
+
+    @property
+    def ast(self) -> ast.Module:
+        return self.shared["ast"]
+
+    @property
+    def reduced_code(self) -> str:
+        return self.shared["reduced code"]
+
+    @property
+    def lines(self) -> dict[int, dict[str, str | list[dis.Instruction]]]:
+        if self._lines is None:
+            shared = self.shared
+            line_mapping: dict[int, int] = shared["line mapping"]
+            start_line_number: int = shared["start line"]
+
+            # Fill the lines dict with info.
+            lines = {}
+            code_lines = self.reduced_code.splitlines()
+            for instruction in shared["instructions"]:
+                if instruction.line_number is None:
+                    continue
+                if instruction.line_number not in lines.keys():
+                    lines[instruction.line_number] = {
+                        "code": code_lines[line_mapping[instruction.line_number] - start_line_number],
+                        "instructions": []
+                    }
+                lines[instruction.line_number]["instructions"].append(instruction)
+            self._lines = lines
+
+        return self._lines
+
+    @property
+    def overview(self) -> str:
+        if self._overview is None:
+            lines = self.lines
+
+            # TODO: Fix a bug that causes the reduced code lines to be duplicated.
+            # Happens when a single line of code is spread over multiple lines.
+            # Example: The expression assigned to overview directly below.
+
+            # Create an overview of the function.
+            self._overview = "\n".join(
+                f"{line_number:-{len(str(tuple(lines.keys())[-1]))}} | "
+                f"{info["code"]:{max(len(val["code"]) for val in lines.values())}} | "
+                f"{", ".join(ins.opname for ins in info["instructions"])}" for line_number, info in lines.items()
+            )
+
+        return self._overview
+
+    def _adaptive(self) -> dict[int, Instruction]:
+        return {instruction.offset: instruction for instruction in dis.get_instructions(self.bytecode.codeobj, adaptive = True)}
+
+    def warm_up(self, *args: ARGS.args, runs: int = 8, **kwargs: ARGS.kwargs) -> dict[int, dict[str, list[str]]]:
+        """
+        Call the function runs times on shallow copies of the arguments, so the adaptive interpreter specialises its hot instructions, and sort each line's
+        instructions, as the interpreter runs them now, into specialised, unspecialised (adaptive, ran, but never specialised), deoptimised (specialised during warm-up but generic again) and generic ones.
+        """
+        import copy, opcode
+
+        # Instructions that are a key of opcode._specializations are adaptive: the interpreter tries to replace them with one of its family when they get hot.
+        # Every instruction in a family is specialised, e.g. BINARY_SUBSCR_LIST_INT of BINARY_SUBSCR.
+        adaptive_opnames = opcode._specializations
+        specialised_opnames = {specialised for family in adaptive_opnames.values() for specialised in family}
+
+        before = self._adaptive()
+        seen: set[int] = set()
+        for _ in range(runs):
+            self.function(*map(copy.copy, args), **kwargs)
+            seen.update(offset for offset, instruction in self._adaptive().items() if instruction.opname in specialised_opnames)
+        after = self._adaptive()
+
+        specialisation = {}
+        for offset, instruction in after.items():
             if instruction.line_number is None:
                 continue
-            if instruction.line_number not in self.lines.keys():
-                self.lines[instruction.line_number] = {
-                    "code": code_lines[line_mapping[instruction.line_number] - start_line_number],
-                    "instructions": []
-                }
-            self.lines[instruction.line_number]["instructions"].append(instruction)
-
-        # TODO: Fix a bug that causes the reduced code lines to be duplicated.
-        # Happens when a single line of code is spread over multiple lines.
-        # Example: The expression assigned to overview directly below.
-
-        # Create an overview of the function.
-        self.overview = "\n".join(
-            f"{line_number:-{len(str(tuple(self.lines.keys())[-1]))}} | "
-            f"{info["code"]:{max(len(val["code"]) for val in self.lines.values())}} | "
-            f"{", ".join(ins.opname for ins in info["instructions"])}" for line_number, info in self.lines.items()
-        )
+            line = specialisation.setdefault(instruction.line_number, {"instructions": [], "specialised": [], "unspecialised": [], "deoptimised": [], "generic": []})
+            line["instructions"].append(instruction.opname)
+            if instruction.opname in specialised_opnames:
+                line["specialised"].append(instruction.opname)
+            elif instruction.opname not in adaptive_opnames:
+                line["generic"].append(instruction.opname)
+            elif offset in seen:
+                line["deoptimised"].append(instruction.opname)
+            # An adaptive instruction counts down its cache counter every time it runs, so an unchanged counter means it never ran at all.
+            elif getattr(instruction, "cache_info", None) != getattr(before[offset], "cache_info", None) or not hasattr(instruction, "cache_info"):
+                line["unspecialised"].append(instruction.opname)
+            else:
+                line["generic"].append(instruction.opname)
+
+        self._specialisation = specialisation
+        return specialisation
+
+    @property
+    def specialisation(self) -> dict[int, dict[str, list[str]]]:
+        if self._specialisation is None:
+            raise RuntimeError("Call warm_up with representative arguments before asking for the specialised instructions.")
+        return self._specialisation
+
+    def adaptive_overview(self, hits: dict[int, int] | None = None) -> str:
+        """
+        The overview with the instructions the adaptive interpreter runs after warm_up, how many of each line's adaptive instructions got specialised,
+        and the ones that did not. Pass Profiler.line_operations as hits to show them next to each line, and to only flag lines that ran.
+        """
+        lines = self.lines
+        specialisation = self.specialisation
+        code_width = max(len(info["code"]) for info in lines.values())
+        hits_width = max(len("hits"), *(len(str(count)) for count in (hits or {0: 0}).values()))
+
+        result = f"{"line":>4} | " + (f"{"hits":>{hits_width}} | " if hits is not None else "") + f"{"code":{code_width}} | spec. | flags | instructions\n"
+        for line_number, info in lines.items():
+            line = specialisation.get(line_number, {"instructions": [], "specialised": [], "unspecialised": [], "deoptimised": [], "generic": []})
+            adaptive_count = len(line["specialised"]) + len(line["unspecialised"]) + len(line["deoptimised"])
+            flags = []
+            if hits is None or hits.get(line_number, 0):
+                flags += [f"unspecialised {opname}" for opname in line["unspecialised"]]
+                flags += [f"deoptimised {opname}" for opname in line["deoptimised"]]
+
+            result += f"{line_number:4} | "
+            if hits is not None:
+                result += f"{hits.get(line_number, 0):{hits_width}} | "
+            result += f"{info["code"]:{code_width}} | {len(line["specialised"]):2}/{adaptive_count:<2} | {", ".join(flags) or "-"} | "
+            result += ", ".join(line["instructions"]) + "\n"
+
+        return result
 
     def __call__(self, *args: ARGS.args, **kwargs: ARGS.kwargs) -> RET:
         return self.function(*args, **kwargs)
@@ -66,3 +195,211 @@ class Analyser[**ARGS, RET](Callable):
 def analyse(algorithm: Callable) -> Analyser:
     return Analyser(algorithm)
 
+def _update(digest, code: CodeType) -> None:
+    digest.update(code.co_code)
+    digest.update(code.co_linetable)
+    digest.update(repr((code.co_names, code.co_varnames)).encode())
+    for constant in code.co_consts:
+        if isinstance(constant, CodeType):
+            _update(digest, constant)
+        elif isinstance(constant, frozenset):
+            # Set order depends on string hashing, which differs between processes.
+            digest.update(repr(sorted(map(repr, constant))).encode())
+        else:
+            digest.update(repr(constant).encode())
+
+def code_digest(code: CodeType, digest_size: int = 16) -> str:
+    """
+    Digest of a code object's bytecode, line table, names and constants, nested code objects included, which stays the same across processes.
+    Changing a literal or a name changes it, unlike a digest of co_code alone.
+    """
+    import hashlib
+    digest = hashlib.blake2b(digest_size = digest_size)
+    _update(digest, code)
+    return digest.hexdigest()
+
+def analysis_key(code: CodeType) -> tuple[str, str, int, str]:
+    """Identify a code object by where it is defined and a digest of its code, which stays the same across processes."""
+    return code.co_filename, code.co_qualname, code.co_firstlineno, code_digest(code)
+
+def source_tree(code: CodeType) -> tuple[ast.Module, int]:
+    """
+    Parse the source of a function as it is in its file, with lines counted from its first line, and return the tree with that start line.
+    Indented functions are parsed inside an if block instead of dedented, since dedenting would also change multi-line strings.
+    """
+    source_lines, start_line_number = inspect.getsourcelines(code)
+    source = "".join(source_lines)
+    if not source[:1].isspace():
+        return ast.parse(source, inspect.getabsfile(code), optimize = 0), start_line_number
+
+    tree = ast.Module(ast.parse("if 1:\n" + source, inspect.getabsfile(code), optimize = 0).body[0].body, [])
+    ast.increment_lineno(tree, -1)
+    return tree, start_line_number
+
+def _reduce(tree: ast.Module) -> str:
+    return re.sub("\n\n+", "\n", ast.unparse(tree))
+
+def _analyse_source(code: CodeType, tree: ast.Module | None = None, start_line_number: int | None = None, reduced: tuple[str, ast.Module] | None = None) -> dict:
+    """
+    Reduce the source of a code object, parsing it unless the caller already has its tree with lines counted from the start line.
+    The reduced code is parsed again to map its lines, unless the caller also has it with its tree.
+    """
+    if tree is None:
+        tree, start_line_number = source_tree(code)
+    if reduced is None:
+        reduced_code = _reduce(tree)
+        reduced_tree = ast.parse(reduced_code, inspect.getabsfile(code), optimize = 0)
+    else:
+        reduced_code, reduced_tree = reduced
+
+    # Wonky workaround to map the original line numbers to the reduced ones.
+    line_mapping: dict[int, int] = {}
+    for i, j in zip(ast.walk(tree), ast.walk(reduced_tree)):
+        if hasattr(i, "lineno") and hasattr(j, "lineno"):
+            line_mapping[i.lineno + start_line_number - 1] = j.lineno + start_line_number - 1
+
+    return {"ast": tree, "reduced code": reduced_code, "line mapping": line_mapping, "start line": start_line_number}
+
+def _cache_path(key: tuple[str, str, int, str]) -> str:
+    import hashlib
+    return os.path.join(cache_directory, hashlib.blake2b(repr(key).encode(), digest_size = 16).hexdigest() + ".pickle")
+
+def _modified(code: CodeType) -> float | None:
+    try:
+        return os.path.getmtime(code.co_filename)
+    except OSError:
+        return None
+
+def _read(key: tuple[str, str, int, str], code: CodeType) -> dict | None:
+    """An analysis from the disk cache, unless the source file was modified after it was stored."""
+    modified = _modified(code)
+    if cache_directory is None or modified is None:
+        return None
+    import pickle
+    try:
+        with open(_cache_path(key), "rb") as file:
+            stored_modified, entry = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+    return entry if stored_modified == modified else None
+
+def _write(key: tuple[str, str, int, str], code: CodeType, entry: dict) -> None:
+    modified = _modified(code)
+    if cache_directory is None or modified is None:
+        return
+    import pickle
+    os.makedirs(cache_directory, exist_ok = True)
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = _dispatch_table()
+    pickler.dump((modified, entry))
+
+    # Write to a temporary name first, so concurrent processes never read a half-written file.
+    path = _cache_path(key)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(buffer.getvalue())
+    os.replace(temporary, path)
+
+def analysis(code: CodeType, source: bool = False, tree: ast.Module | None = None, start_line_number: int | None = None, reduced: tuple[str, ast.Module] | None = None) -> dict:
+    """
+    The shared analysis of a code object: its instructions and line table, and with source also its AST, reduced code and line mapping.
+    Analyses are kept in a bounded LRU cache and, when cache_directory is set, pickled to disk until the source file changes.
+    A tree of the function alone, with its start line, and its reduced code with the tree of that can be passed in to skip parsing them.
+    """
+    key = analysis_key(code)
+    entry = _analyses.get(key)
+    if entry is None:
+        entry = _read(key, code)
+        stored = entry is not None
+        if entry is None:
+            entry = {"instructions": list(dis.get_instructions(code)), "line table": line_table(code)}
+        _analyses[key] = entry
+        if len(_analyses) > CACHE_SIZE:
+            _analyses.popitem(last = False)
+    else:
+        _analyses.move_to_end(key)
+        stored = True
+
+    if source and "ast" not in entry:
+        entry.update(_analyse_source(code, tree, start_line_number, reduced))
+        stored = False
+
+    if not stored:
+        _write(key, code, entry)
+    return entry
+
+def analyse_module(module: ModuleType) -> dict[str, Analyser]:
+    """
+    Analysers for every function and method defined in a module, keyed by qualified name.
+    The module file is parsed once and each function's tree is cut out of it, instead of parsing the source of every function separately.
+    The reduced code of all functions is likewise parsed in one go.
+    """
+    functions = {}
+    for value in vars(module).values():
+        members = vars(value).values() if isinstance(value, type) else (value,)
+        for member in members:
+            if isinstance(member, (staticmethod, classmethod)):
+                member = member.__func__
+            if isinstance(member, FunctionType) and member.__module__ == module.__name__:
+                functions[member.__code__.co_firstlineno] = member
+
+    # Only module and class bodies can define the functions found above, so nothing else in the tree is visited.
+    filename = inspect.getabsfile(module)
+    nodes = ast.parse(inspect.getsource(module), filename, optimize = 0).body
+    found = []
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, ast.ClassDef):
+            nodes.extend(node.body)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            # The first line of a function's code is its first decorator, like the start line inspect reports.
+            start_line_number = min([node.lineno, *(decorator.lineno for decorator in node.decorator_list)])
+            function = functions.get(start_line_number)
+            if function is not None:
+                # The module tree is not used again, so the function's node is moved into its own tree without a copy.
+                tree = ast.Module([node], [])
+                ast.increment_lineno(tree, 1 - start_line_number)
+                found.append((function, tree, start_line_number, _reduce(tree)))
+
+    # Every reduced function is a single statement without blank lines, so the statements of the joined code are the functions in order.
+    first_line_number = 1
+    for (function, tree, start_line_number, reduced_code), node in zip(found, ast.parse("\n".join(reduced for *_, reduced in found), filename, optimize = 0).body):
+        reduced_tree = ast.Module([node], [])
+        ast.increment_lineno(reduced_tree, 1 - first_line_number)
+        first_line_number += reduced_code.count("\n") + 1
+        analysis(function.__code__, source = True, tree = tree, start_line_number = start_line_number, reduced = (reduced_code, reduced_tree))
+
+    return {function.__qualname__: Analyser(function) for function in functions.values()}
+
+def code_objects(code: CodeType) -> list[CodeType]:
+    """Collect a code object and every code object nested in its constants."""
+    found = [code]
+    for constant in code.co_consts:
+        if isinstance(constant, CodeType):
+            found.extend(code_objects(constant))
+    return found
+
+def line_table(code: CodeType) -> array:
+    """Map every bytecode offset of a code object to its line number, or 0 where it has none."""
+    table = array("I", [0]) * len(code.co_code)
+    for start, end, line_number in code.co_lines():
+        if line_number is not None:
+            table[start:end] = array("I", [line_number]) * (end - start)
+    return table
+
+def flat_tables(codes: list[CodeType]) -> tuple[dict[int, int], array, array]:
+    """
+    Lay several code objects out after each other, so that one flat offset identifies both a code object and an offset inside it.
+    Returns the base of every code object keyed by its id, and the line number and code index of every flat offset.
+    Bases are keyed by id, since hashing a code object on every event is expensive.
+    """
+    bases: dict[int, int] = {}
+    lines = array("I")
+    indices = array("H")
+    for index, code in enumerate(codes):
+        bases[id(code)] = len(lines)
+        table = analysis(code)["line table"]
+        lines.extend(table)
+        indices.extend(array("H", [index]) * len(table))
+    return bases, lines, indices
@@ -0,0 +1,354 @@
+from sys import argv
+from random import Random, seed, randint, choice
+from time import perf_counter_ns
+from typing import Callable, MutableSequence
+from statistics import median, quantiles
+
+import sorting_algorithms
+from sorting_algorithms import algorithms, sort_function
+from evaluator import Evaluator, categories
+from timing import summarise
+from profiler import Profiler
+from sampling import Sampler
+from tracing import Event, backends
+from events import EventBuffer, event_codes
+from rewrite import instrument
+import datasets
+
+def random_array(length: int) -> list[int]:
+    return [randint(0, 2 * length) for _ in range(length)]
+
+def best_time(function: Callable, array: MutableSequence, repeats: int = 3) -> int:
+    best = None
+    for _ in range(repeats):
+        copy = list(array)
+        start = perf_counter_ns()
+        function(copy)
+        end = perf_counter_ns()
+        if best is None or end - start < best:
+            best = end - start
+    return best
+
+def profiler_overhead(length: int = 300, repeats: int = 3) -> str:
+    """Slowdown of every available tracing backend relative to a bare run of each sort, counting lines only as Profiler does by default, and lines and opcodes."""
+    seed(0)
+    array = random_array(length)
+    columns = [(name, opcodes) for name, backend in backends.items() if backend.available() for opcodes in (False, True)]
+
+    result = f"{"algorithm":15} | {"bare (ms)":>10} | " + " | ".join(f"{name + (" + opcodes" if opcodes else ""):>20}" for name, opcodes in columns) + "\n"
+    for algorithm, info in algorithms.items():
+        bare = best_time(info["function"], array, repeats)
+        result += f"{algorithm:15} | {bare / 1_000_000:10.3f} | "
+        result += " | ".join(f"{best_time(Profiler(info["function"], name, opcodes = opcodes), array, repeats) / bare:19.1f}x" for name, opcodes in columns)
+        result += "\n"
+
+    return result
+
+def line_index_scaling(sizes: tuple[int, ...] = (10_000, 100_000, 1_000_000)) -> str:
+    """Time to fold synthetic line events into per-line counts. A constant time per event means linear scaling."""
+    seed(0)
+    profiler = Profiler(algorithms["merge"]["function"])
+    offsets = [instruction.offset for instruction in profiler.instructions if instruction.positions.lineno is not None]
+
+    result = f"{"events":>10} | {"total (ms)":>10} | {"per event (ns)":>14}\n"
+    for size in sizes:
+        buffer = EventBuffer()
+        for _ in range(size):
+            buffer.append(choice(offsets), event_codes[Event.LINE])
+        buffer.flush()
+        profiler.timings = [{"operations": buffer, "time": 0, "overhead": [0.0] * len(event_codes)}]
+
+        start = perf_counter_ns()
+        profiler.line_operations()
+        end = perf_counter_ns()
+        result += f"{size:10} | {(end - start) / 1_000_000:10.3f} | {(end - start) / size:14.1f}\n"
+
+    return result
+
+def sampling_overhead(lengths: dict[str, int] = {"insertion": 2_000, "quick": 100_000, "merge": 100_000, "radix": 100_000, "merge_buffered": 100_000, "radix_bytes": 100_000}, rate: float = 1000, repeats: int = 21) -> str:
+    """
+    Slowdown of the sampling profiler relative to a bare run of each sort, and the sample rate it achieved. The target is below 5%.
+    Bare and sampled runs take turns, so drift in the machine's speed hits both alike, and their medians are compared.
+    """
+    seed(0)
+
+    result = f"{"algorithm":14} | {"bare (ms)":>10} | {"sampled (ms)":>12} | {"overhead":>8} | {"noise":>6} | {"samples/s":>9}\n"
+    for algorithm, info in algorithms.items():
+        array = random_array(lengths[algorithm])
+        sampler = Sampler(info["function"], rate)
+        bare, sampled = [], []
+        for _ in range(repeats):
+            for function, times in ((info["function"], bare), (sampler, sampled)):
+                copy = list(array)
+                start = perf_counter_ns()
+                function(copy)
+                end = perf_counter_ns()
+                times.append(end - start)
+
+        bare_median, sampled_median = median(bare), median(sampled)
+        # Half the interquartile range of the bare runs, relative to their median.
+        low, _, high = quantiles(bare, n = 4)
+        noise = (high - low) / 2 / bare_median
+        achieved = median((sum(timing["samples"].values()) + timing["missed"]) / timing["time"] for timing in sampler.timings)
+        result += f"{algorithm:14} | {bare_median / 1_000_000:10.3f} | {sampled_median / 1_000_000:12.3f} | {100 * (sampled_median - bare_median) / bare_median:7.1f}% | {100 * noise:5.1f}% | {achieved:9.0f}\n"
+
+    result += "Overheads within the noise, half the interquartile range of the bare runs, cannot be told apart from zero.\n"
+    result += f"A sample is only taken when the sampling thread gets the GIL, so the achieved rate can fall well short of the requested {rate:g} per second, the more so the higher it is.\n"
+    return result
+
+def block_counting(length: int = 500) -> str:
+    """
+    Compare full opcode counting with block entry counting on every sort in sorting_algorithms.
+    The category totals must be identical; the time column shows what each mode costs.
+    """
+    seed(0)
+    array = random_array(length)
+    functions = [sorting_algorithms.bubble_sort, *(info["function"] for info in algorithms.values())]
+
+    result = f"{"function":19} | {"opcodes (ms)":>12} | {"blocks (ms)":>11} | {"speedup":>7} | equal\n"
+    for function in functions:
+        totals = {}
+        times = {}
+        for backend in ("monitoring", "blocks"):
+            evaluator = Evaluator(backend)
+            measured = evaluator.measure(function)
+            copy = list(array)
+            start = perf_counter_ns()
+            measured(copy)
+            end = perf_counter_ns()
+            evaluator.close()
+            times[backend] = end - start
+            totals[backend] = [evaluator[function.__name__][category] for category in categories]
+
+        if totals["monitoring"] != totals["blocks"]:
+            raise AssertionError(f"Block counts of {function.__name__} differ from opcode counts: {totals["blocks"]} != {totals["monitoring"]}")
+        result += f"{function.__name__:19} | {times["monitoring"] / 1_000_000:12.3f} | {times["blocks"] / 1_000_000:11.3f} | {times["monitoring"] / times["blocks"]:6.1f}x | yes\n"
+
+    return result
+
+def dataset_loading(size: int = 1_000_000, repeats: int = 5) -> str:
+    """Time to get a fresh input list by generating it versus copying it out of the memory-mapped dataset cache."""
+    result = f"{"distribution":13} | {"generate (ms)":>13} | {"cached copy (ms)":>16} | speedup\n"
+    for distribution, generator in datasets.generators.items():
+        datasets.load(distribution, size).close()
+
+        start = perf_counter_ns()
+        generator(Random(0), size)
+        generate = perf_counter_ns() - start
+
+        dataset = datasets.load(distribution, size)
+        cached = None
+        for _ in range(repeats):
+            start = perf_counter_ns()
+            dataset.copy()
+            end = perf_counter_ns()
+            cached = end - start if cached is None else min(cached, end - start)
+        dataset.close()
+
+        result += f"{distribution:13} | {generate / 1_000_000:13.2f} | {cached / 1_000_000:16.2f} | {generate / cached:6.1f}x\n"
+    return result
+
+def backend_speedup(lengths: dict[str, int] = {"insertion": 2_000, "quick": 100_000, "merge": 100_000, "radix": 100_000}, distributions: tuple[str, ...] = ("uniform", "wide"), repeats: int = 3) -> str:
+    """Speedup of every alternative backend against the pure-Python implementation of each sort on the same cached datasets."""
+    try:
+        import numpy
+    except ImportError:
+        return "Skipped: NumPy is not installed, so there is no backend to compare against.\n"
+    from timing import time_function
+
+    result = f"{"algorithm":10} | {"backend":8} | {"distribution":13} | {"length":>7} | {"python (ms)":>11} | {"backend (ms)":>12} | speedup\n"
+    for algorithm, length in lengths.items():
+        for distribution in distributions:
+            dataset = datasets.load(distribution, length)
+            array = dataset.copy()
+            python = time_function(sort_function(algorithm), array, repeats, loops = 1).median
+
+            for backend in algorithms[algorithm]["backends"]:
+                if backend == "python":
+                    continue
+                function = sort_function(algorithm, backend)
+                # NumPy backends get their input as an ndarray, so the comparison leaves out list conversion.
+                data, copy = (numpy.frombuffer(dataset.tobytes(), dtype = numpy.int64), numpy.copy) if backend == "numpy" else (array, list)
+                timed = time_function(function, data, repeats, loops = 1, copy = copy).median
+                result += f"{algorithm:10} | {backend:8} | {distribution:13} | {length:7} | {python / 1_000_000:11.2f} | {timed / 1_000_000:12.3f} | {python / timed:6.1f}x\n"
+
+            dataset.close()
+
+    return result
+
+def allocation_savings(length: int = 100_000, distribution: str = "wide", repeats: int = 5) -> str:
+    """Peak memory and time of the buffered merge sort and byte radix sort against the originals, measured by an Evaluator without operation counting."""
+    dataset = datasets.load(distribution, length)
+    array = dataset.copy()
+    dataset.close()
+
+    result = f"{"algorithm":15} | {"peak (KiB)":>10} | {"time (ms)":>9} | {"memory":>7} | {"speedup":>7}\n"
+    for original, variant in (("merge", "merge_buffered"), ("radix", "radix_bytes")):
+        evaluator = Evaluator("none", memory = "peak")
+        rows = {}
+        for name in (original, variant):
+            function = algorithms[name]["function"]
+            evaluator.measure(function)(list(array))
+            evaluator.time(function, array, repeats, loops = 1)
+            measured = evaluator[function.__name__]
+            rows[name] = measured["memory usage"][0]["peak"], summarise(measured["time"]).median
+        evaluator.close()
+
+        for name in (original, variant):
+            peak, time = rows[name]
+            result += f"{name:15} | {peak / 1024:10.1f} | {time / 1_000_000:9.2f} | {rows[original][0] / max(peak, 1):6.1f}x | {rows[original][1] / time:6.1f}x\n"
+
+    return result
+
+def auxiliary_space(sizes: tuple[int, ...] = (250, 1_000, 4_000)) -> str:
+    """
+    Peak auxiliary bytes per input element of every sort, measured with tracemalloc beyond the input list.
+    A constant column means O(n) extra space, a column falling towards zero means O(1).
+    """
+    result = f"{"algorithm":15} | " + " | ".join(f"{f"n = {size}":>12}" for size in sizes) + "\n"
+    for name, info in algorithms.items():
+        evaluator = Evaluator("none", memory = "peak")
+        measured = evaluator.measure(info["function"])
+        for size in sizes:
+            dataset = datasets.load("uniform", size)
+            measured(dataset.copy())
+            dataset.close()
+        evaluator.close()
+        peaks = [memory["peak"] for memory in evaluator[info["function"].__name__]["memory usage"]]
+        result += f"{name:15} | " + " | ".join(f"{peak / size:12.2f}" for peak, size in zip(peaks, sizes)) + "\n"
+
+    return result
+
+def analyser_startup(module: str = "evaluator", repeats: int = 5) -> str:
+    """
+    Cost of importing analyser, of wrapping every function of a module in an Analyser, and of building all their overviews
+    with one parse per function versus one parse of the whole module through analyse_module. The analysis cache is cleared before every run.
+    """
+    import os, sys, subprocess, importlib, analyser
+
+    def best(run: Callable) -> int:
+        best = None
+        for _ in range(repeats):
+            analyser._analyses.clear()
+            start = perf_counter_ns()
+            run()
+            end = perf_counter_ns()
+            best = end - start if best is None else min(best, end - start)
+        return best
+
+    target = importlib.import_module(module)
+    functions = list(analyser.analyse_module(target).values())
+    functions = [wrapped.function for wrapped in functions]
+
+    timings = {
+        "interpreter": best(lambda: subprocess.run([sys.executable, "-c", "pass"], check = True)),
+        # Run from the analyser's own directory, so it is found wherever the benchmarks are started from.
+        "import analyser": best(lambda: subprocess.run([sys.executable, "-c", "import analyser"], check = True, cwd = os.path.dirname(os.path.abspath(analyser.__file__)))),
+        "wrap": best(lambda: [analyser.Analyser(function) for function in functions]),
+        "overview per function": best(lambda: [analyser.Analyser(function).overview for function in functions]),
+        "overview analyse_module": best(lambda: [wrapped.overview for wrapped in analyser.analyse_module(target).values()])
+    }
+
+    result = f"{module}: {len(functions)} functions\n{"step":23} | {"time (ms)":>9}\n"
+    for step, time in timings.items():
+        result += f"{step:23} | {time / 1_000_000:9.3f}\n"
+    return result
+
+def bulk_analysis(root: str | None = None) -> str:
+    """Time to analyse every code object of a package tree, the standard library by default, streamed as JSON Lines to nowhere."""
+    import os, bulk
+
+    root = root or os.path.dirname(os.__file__)
+    with open(os.devnull, "w") as output:
+        start = perf_counter_ns()
+        count = bulk.analyse_package(root, output)
+        end = perf_counter_ns()
+
+    return f"{root}: {count} code objects in {(end - start) / 1_000_000_000:.2f} s, {(end - start) / count / 1000:.1f} μs each\n"
+
+def element_counting(length: int = 10_000, large: int = 1_000_000, large_algorithms: tuple[str, ...] = ("quick", "merge")) -> str:
+    """
+    Slowdown of counting with element proxies against bare runs and against the tracer-based counting backends.
+    The proxies stay usable at large sizes, which are only run in elements mode.
+    """
+    dataset = datasets.load("uniform", length)
+    array = dataset.copy()
+    dataset.close()
+
+    modes = ("elements", "blocks", "monitoring")
+    result = f"{"algorithm":15} | {"n":>8} | {"bare (ms)":>10} | " + " | ".join(f"{mode:>10}" for mode in modes) + f" | {"comparisons":>12}\n"
+    rows = [(name, array, modes) for name in ("quick", "merge", "radix")]
+
+    dataset = datasets.load("uniform", large)
+    large_array = dataset.copy()
+    dataset.close()
+    rows += [(name, large_array, ("elements",)) for name in large_algorithms]
+
+    for name, data, selected in rows:
+        function = algorithms[name]["function"]
+        bare = best_time(function, data, 1)
+        slowdowns = []
+        comparisons = 0
+        for mode in modes:
+            if mode not in selected:
+                slowdowns.append(f"{"-":>10}")
+                continue
+            evaluator = Evaluator(mode)
+            measured = evaluator.measure(function)
+            start = perf_counter_ns()
+            measured(list(data))
+            end = perf_counter_ns()
+            evaluator.close()
+            slowdowns.append(f"{(end - start) / bare:9.1f}x")
+            if mode == "elements":
+                comparisons = evaluator[function.__name__]["comparisons"]
+        result += f"{name:15} | {len(data):8} | {bare / 1_000_000:10.2f} | " + " | ".join(slowdowns) + f" | {comparisons:12}\n"
+
+    return result
+
+def rewritten_counting(length: int = 2_000, repeats: int = 3) -> str:
+    """
+    Slowdown of line counting with counters compiled into a copy of each sort against a bare run and against the monitoring Profiler.
+    Lines whose counts differ from Profiler.line_operations are listed; only lines with generator expressions or lambdas should show up.
+    """
+    seed(0)
+    array = random_array(length)
+
+    result = f"{"algorithm":15} | {"bare (ms)":>10} | {"rewritten":>9} | {"profiler":>9} | differing lines\n"
+    for algorithm, info in algorithms.items():
+        bare = best_time(info["function"], array, repeats)
+        instrumented = instrument(info["function"])
+        rewritten = best_time(instrumented, array, repeats)
+        profiler = Profiler(info["function"], "monitoring", opcodes = False)
+        traced = best_time(profiler, array, repeats)
+
+        instrumented.reset()
+        instrumented(list(array))
+        profiler(list(array))
+        expected = profiler.line_operations(len(profiler.timings) - 1)
+        counted = instrumented.line_operations()
+        differing = [line for line in sorted(expected.keys() | counted.keys()) if expected.get(line) != counted.get(line)]
+        result += f"{algorithm:15} | {bare / 1_000_000:10.3f} | {rewritten / bare:8.2f}x | {traced / bare:8.1f}x | {", ".join(map(str, differing)) or "none"}\n"
+
+    return result
+
+benchmarks = {
+    "profiler": profiler_overhead,
+    "line index": line_index_scaling,
+    "sampling": sampling_overhead,
+    "blocks": block_counting,
+    "datasets": dataset_loading,
+    "backends": backend_speedup,
+    "allocations": allocation_savings,
+    "auxiliary": auxiliary_space,
+    "analyser": analyser_startup,
+    "bulk": bulk_analysis,
+    "elements": element_counting,
+    "rewrite": rewritten_counting
+}
+
+if __name__ == "__main__":
+
+    for name in argv[1:] or benchmarks.keys():
+        print(f"---------- {name} ----------")
+        print(benchmarks[name]())
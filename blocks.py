@@ -0,0 +1,183 @@
+import sys, dis, threading
+from array import array
+from types import CodeType
+from typing import NamedTuple
+
+__all__ = "BasicBlock", "basic_blocks", "block_table", "BlockCounter"
+
+JUMPS = frozenset(getattr(dis, "hasjump", dis.hasjrel + dis.hasjabs))
+TERMINATORS = frozenset(dis.opmap[opname] for opname in ("RETURN_VALUE", "RETURN_CONST", "RAISE_VARARGS", "RERAISE") if opname in dis.opmap)
+
+# Instructions the interpreter may step over when a loop or send finishes, depending on the version and on whether the loop is instrumented.
+# They and the instructions right after them start blocks of their own, so each is counted only when it actually runs.
+SKIPPABLE = frozenset(dis.opmap[opname] for opname in ("END_FOR", "END_SEND") if opname in dis.opmap)
+SKIP_DISTANCE = 3
+
+class BasicBlock(NamedTuple):
+    start: int
+    instructions: list[dis.Instruction]
+
+def basic_blocks(code: CodeType) -> list[BasicBlock]:
+    """
+    Split a code object into straight-line blocks: every instruction of a block runs exactly as often as the block's start, unless an exception is raised inside it.
+    Blocks start at the first instruction, at jump targets, at exception handlers and after jumps, returns, raises and loop ends.
+    The prologue up to RESUME never reports an event and is left out, so the block counts reproduce full opcode tracing exactly.
+    """
+    instructions = list(dis.get_instructions(code))
+    resume = dis.opmap["RESUME"]
+    for index, instruction in enumerate(instructions):
+        if instruction.opcode == resume:
+            instructions = instructions[index + 1:]
+            break
+    instructions = [instruction for instruction in instructions if instruction.opcode != resume]
+
+    leaders = {instructions[0].offset} if instructions else set()
+    for index, instruction in enumerate(instructions):
+        if instruction.opcode in JUMPS:
+            leaders.add(instruction.argval)
+        if instruction.opcode in JUMPS or instruction.opcode in TERMINATORS:
+            if index + 1 < len(instructions):
+                leaders.add(instructions[index + 1].offset)
+        if instruction.opcode in SKIPPABLE:
+            leaders.update(following.offset for following in instructions[index:index + SKIP_DISTANCE + 1])
+
+    for entry in dis.Bytecode(code).exception_entries:
+        leaders.add(entry.target)
+
+    blocks = []
+    for instruction in instructions:
+        if instruction.offset in leaders or not blocks:
+            blocks.append(BasicBlock(instruction.offset, []))
+        blocks[-1].instructions.append(instruction)
+
+    return blocks
+
+def block_table(code: CodeType, blocks: list[BasicBlock]) -> array:
+    """Map the first offset of every block to the block index, and every other offset to -1."""
+    table = array("i", [-1]) * len(code.co_code)
+    for index, block in enumerate(blocks):
+        table[block.start] = index
+    return table
+
+class BlockCounter(object):
+    """
+    Counts block entries for a set of code objects through sys.monitoring INSTRUCTION events.
+    The first time an instruction that does not start a block runs, its event is disabled, so after warming up only block entries cost a callback.
+    Multiplying the block counts by the per-block histograms gives the exact execution count of every instruction.
+    Events, and the tool ID, are only taken between enter and exit. Every thread counts into its own arrays, which exit adds to counts.
+    """
+
+    def __init__(self, tool_name: str = "pyrftester blocks") -> None:
+        if not hasattr(sys, "monitoring"):
+            raise RuntimeError(f"Block counting needs sys.monitoring, which is not available on Python {sys.version.split()[0]}.")
+
+        # The tool ID is only held while some thread is between enter and exit, so any number of counters can exist at once.
+        self.tool_name = tool_name
+        self.tool_id: int | None = None
+
+        self.codes: dict[int, CodeType] = {}
+        self.blocks: dict[int, list[BasicBlock]] = {}
+        self.counts: dict[int, array] = {}
+        tables: dict[int, array] = {}
+        self.tables = tables
+        local = threading.local()
+        self.local = local
+        self.lock = threading.Lock()
+        self.active = 0
+        disable = sys.monitoring.DISABLE
+
+        def on_instruction(code: CodeType, offset: int):
+            index = tables[id(code)][offset]
+            if index < 0:
+                return disable
+            # Threads outside enter and exit, and code added after the thread entered, have no counts of their own.
+            try:
+                local.counts[id(code)][index] += 1
+            except (AttributeError, KeyError):
+                pass
+
+        self.on_instruction = on_instruction
+
+    def add(self, code: CodeType) -> None:
+        if id(code) in self.codes:
+            return
+        blocks = basic_blocks(code)
+        with self.lock:
+            self.codes[id(code)] = code
+            self.blocks[id(code)] = blocks
+            self.counts[id(code)] = array("Q", [0]) * len(blocks)
+            self.tables[id(code)] = block_table(code, blocks)
+            if self.tool_id is not None:
+                sys.monitoring.set_local_events(self.tool_id, code, sys.monitoring.events.INSTRUCTION)
+
+    def _acquire(self) -> None:
+        from tracing import MonitoringBackend
+
+        monitoring = sys.monitoring
+        self.tool_id = MonitoringBackend.free_tool_id()
+        monitoring.use_tool_id(self.tool_id, self.tool_name)
+        monitoring.register_callback(self.tool_id, monitoring.events.INSTRUCTION, self.on_instruction)
+        for code in self.codes.values():
+            monitoring.set_local_events(self.tool_id, code, monitoring.events.INSTRUCTION)
+
+    def _release(self) -> None:
+        monitoring = sys.monitoring
+        for code in self.codes.values():
+            monitoring.set_local_events(self.tool_id, code, monitoring.events.NO_EVENTS)
+        monitoring.register_callback(self.tool_id, monitoring.events.INSTRUCTION, None)
+        monitoring.free_tool_id(self.tool_id)
+        self.tool_id = None
+
+    def enter(self) -> None:
+        """Start counting the calling thread, turning events on if no other thread is counting."""
+        with self.lock:
+            self.local.counts = {code_id: array("Q", [0]) * len(counts) for code_id, counts in self.counts.items()}
+            self.active += 1
+            if self.active == 1:
+                self._acquire()
+
+    def exit(self) -> None:
+        """Add the calling thread's counts to the totals, turning events off when no thread is counting anymore."""
+        with self.lock:
+            for code_id, counts in self.local.counts.items():
+                totals = self.counts[code_id]
+                for index, count in enumerate(counts):
+                    if count:
+                        totals[index] += count
+            del self.local.counts
+            self.active -= 1
+            if self.active == 0:
+                self._release()
+
+    def offset_counts(self, code: CodeType) -> dict[int, int]:
+        """Execution count of every instruction offset in a code object."""
+        return {
+            instruction.offset: count
+            for block, count in zip(self.blocks[id(code)], self.counts[id(code)])
+            for instruction in block.instructions
+        }
+
+    def opname_counts(self, code: CodeType) -> dict[str, int]:
+        totals = {}
+        for block, count in zip(self.blocks[id(code)], self.counts[id(code)]):
+            if count:
+                for instruction in block.instructions:
+                    totals[instruction.opname] = totals.get(instruction.opname, 0) + count
+        return totals
+
+    def close(self) -> None:
+        """Release the tool ID, even if a thread never called exit."""
+        with self.lock:
+            if self.tool_id is not None:
+                self._release()
+            self.active = 0
+
+    def __enter__(self) -> "BlockCounter":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if getattr(self, "tool_id", None) is not None and hasattr(sys, "monitoring"):
+            self._release()
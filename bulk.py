@@ -0,0 +1,99 @@
+import os, sys, json
+from typing import Iterable, TextIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import Counter
+from dis import opname as opnames, opmap
+from types import CodeType
+
+from analyser import code_objects
+from evaluator import bytecodes, categories, opcode_categories, OTHER, _opnames
+
+__all__ = "module_files", "analyse_code", "analyse_file", "analyse_package"
+
+CACHE = opmap["CACHE"]
+
+# The top-level group of every opcode in the bytecodes taxonomy, e.g. "CALLS" or "MISC".
+opcode_groups: dict[str, str] = {opname: group for group, taxonomy in bytecodes.items() for opname in _opnames(taxonomy)}
+
+def module_files(root: str) -> Iterable[tuple[str, str]]:
+    """Every Python file below root with its dotted module name, in a stable order. Root may also be a single file."""
+    if os.path.isfile(root):
+        yield os.path.splitext(os.path.basename(root))[0], root
+        return
+
+    base = os.path.dirname(os.path.abspath(root))
+    for directory, directories, files in os.walk(root):
+        directories[:] = sorted(name for name in directories if name != "__pycache__" and not name.startswith("."))
+        for name in sorted(files):
+            if name.endswith(".py"):
+                path = os.path.join(directory, name)
+                parts = os.path.relpath(path, base)[:-3].split(os.sep)
+                if parts[-1] == "__init__":
+                    parts.pop()
+                yield ".".join(parts), path
+
+def analyse_code(code: CodeType) -> dict:
+    """Opcode histogram, size metrics and category summaries of a single code object, without its nested code objects."""
+    # Every instruction is one two-byte code unit in co_code, followed by its inline cache units, so counting
+    # the opcode bytes and dropping CACHE gives the histogram without building an Instruction per unit.
+    opcodes = Counter({opnames[opcode]: count for opcode, count in Counter(code.co_code[::2]).items() if opcode != CACHE})
+
+    counts = [0] * len(categories)
+    groups = Counter()
+    for opname, count in opcodes.items():
+        counts[opcode_categories.get(opname, OTHER)] += count
+        groups[opcode_groups.get(opname, "UNKNOWN")] += count
+
+    return {
+        "name": code.co_qualname,
+        "line": code.co_firstlineno,
+        "instructions": opcodes.total(),
+        "bytes": len(code.co_code),
+        "lines": len({line for _, _, line in code.co_lines() if line is not None}),
+        "arguments": code.co_argcount + code.co_kwonlyargcount,
+        "locals": code.co_nlocals,
+        "stack size": code.co_stacksize,
+        "constants": len(code.co_consts),
+        "opcodes": dict(opcodes.most_common()),
+        "categories": dict(zip(categories, counts)),
+        "groups": dict(groups.most_common())
+    }
+
+def analyse_file(module: str, path: str) -> list[dict]:
+    """
+    Compile a file without importing it and analyse every code object in it: the module body, functions, methods, lambdas, comprehensions and class bodies.
+    A file that cannot be read or compiled gives a single record with the error.
+    """
+    try:
+        with open(path, "rb") as file:
+            code = compile(file.read(), path, "exec", dont_inherit = True)
+    except (OSError, SyntaxError, ValueError) as error:
+        return [{"module": module, "file": path, "error": f"{type(error).__name__}: {error}"}]
+
+    return [{"module": module, "file": path, **analyse_code(nested)} for nested in code_objects(code)]
+
+def analyse_package(root: str, output: TextIO = sys.stdout, workers: int | None = None) -> int:
+    """
+    Analyse every module below root on a process pool and stream one JSON object per code object to output as each module finishes.
+    Returns the number of code objects written.
+    """
+    written = 0
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(analyse_file, module, path) for module, path in module_files(root)]
+        for future in as_completed(futures):
+            records = future.result()
+            output.write("".join(json.dumps(record) + "\n" for record in records))
+            written += sum("error" not in record for record in records)
+
+    return written
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        raise SystemExit("Usage: python bulk.py <package directory or file> [output.jsonl]")
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "w") as file:
+            analyse_package(sys.argv[1], file)
+    else:
+        analyse_package(sys.argv[1])
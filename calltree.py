@@ -0,0 +1,160 @@
+from array import array
+from itertools import repeat
+
+from tracing import Event
+from events import EventBuffer, event_codes
+
+__all__ = "CallTree",
+
+class CallTree(object):
+    """
+    Call tree of a traced run, stored as flat arrays indexed by node.
+    Direct recursion is folded into the caller's node, so the size of the tree depends on the distinct call paths and not on the recursion depth.
+    Times are in nanoseconds and are only available when the run was recorded with timestamps.
+    They are kept as they come out of the overhead correction, even below zero, and only clamped at zero in edges and collapsed.
+    """
+    __slots__ = (
+        "names",
+        "parents",
+        "codes",
+        "calls",
+        "recursive_calls",
+        "inclusive",
+        "exclusive",
+        "events",
+        "children"
+    )
+
+    def __init__(self, names: list[str]) -> None:
+        self.names = names
+
+        # Node 0 is the root, which stands for the caller of the profiled function.
+        self.parents = array("i", [-1])
+        self.codes = array("i", [-1])
+        self.calls = array("Q", [0])
+        self.recursive_calls = array("Q", [0])
+        self.inclusive = array("q", [0])
+        self.exclusive = array("q", [0])
+        self.events = array("Q", [0])
+        self.children: dict[tuple[int, int], int] = {}
+
+    def node(self, parent: int, code: int) -> int:
+        key = (parent, code)
+        if key not in self.children:
+            self.children[key] = len(self.parents)
+            self.parents.append(parent)
+            self.codes.append(code)
+            for column in (self.calls, self.recursive_calls, self.inclusive, self.exclusive, self.events):
+                column.append(0)
+        return self.children[key]
+
+    @classmethod
+    def build(cls, buffer: EventBuffer, code_table: array, names: list[str], overhead: list[float] | None = None) -> "CallTree":
+        """
+        Replay the call and return events of a run. code_table maps every recorded offset to an index into names.
+        overhead is the tracer overhead per event indexed by event code. Each frame's time is corrected by the overhead of the events from its call to its return.
+        """
+        tree = cls(names)
+        call = event_codes[Event.CALL]
+        ret = event_codes[Event.RETURN]
+        overhead = overhead or [0.0] * len(event_codes)
+
+        # One entry per active frame: node, start time, start index, overhead spent before it, time and events spent in children, and whether it is a recursive call.
+        nodes = array("i", [0])
+        starts = array("q", [0])
+        indices = array("q", [0])
+        spent_before = array("d", [0.0])
+        child_times = array("q", [0])
+        child_events = array("q", [0])
+        recursive = array("b", [0])
+
+        index = -1
+        spent = 0.0
+        for offsets, events, times in buffer.chunk_columns():
+            for offset, event, time in zip(offsets, events, times if times is not None else repeat(0)):
+                index += 1
+                cost = overhead[event]
+                spent += cost
+                if event != call and event != ret:
+                    continue
+                code = code_table[offset]
+
+                if event == call:
+                    top = nodes[-1]
+                    is_recursive = tree.codes[top] == code
+                    node = top if is_recursive else tree.node(top, code)
+                    if is_recursive:
+                        tree.recursive_calls[node] += 1
+                    else:
+                        tree.calls[node] += 1
+
+                    nodes.append(node)
+                    starts.append(time)
+                    indices.append(index)
+                    spent_before.append(spent - cost)
+                    child_times.append(0)
+                    child_events.append(0)
+                    recursive.append(is_recursive)
+                    continue
+
+                # A return without a matching call, e.g. from a frame entered before tracing started.
+                if len(nodes) == 1:
+                    continue
+
+                node = nodes.pop()
+                events_inside = index - indices.pop() + 1
+                # The overhead of the return event itself comes after the frame has ended.
+                # Times are kept as they are even when the correction takes them below zero, so a parent's time stays the sum of its own and its children's.
+                elapsed = round(time - starts.pop() - (spent - cost - spent_before.pop()))
+
+                tree.exclusive[node] += elapsed - child_times.pop()
+                tree.events[node] += events_inside - child_events.pop()
+                if not recursive.pop():
+                    tree.inclusive[node] += elapsed
+
+                child_times[-1] += elapsed
+                child_events[-1] += events_inside
+
+        return tree
+
+    def __len__(self) -> int:
+        return len(self.parents) - 1
+
+    def path(self, node: int) -> list[str]:
+        path = []
+        while node > 0:
+            path.append(self.names[self.codes[node]])
+            node = self.parents[node]
+        return path[::-1]
+
+    def edges(self) -> dict[tuple[str, str], dict[str, int]]:
+        """Caller to callee edges with their call counts and inclusive time. Recursive calls appear as self edges."""
+        edges = {}
+        for node in range(1, len(self.parents)):
+            parent = self.parents[node]
+            callee = self.names[self.codes[node]]
+            caller = self.names[self.codes[parent]] if parent > 0 else "<root>"
+
+            edge = edges.setdefault((caller, callee), {"calls": 0, "inclusive": 0})
+            edge["calls"] += self.calls[node]
+            edge["inclusive"] += self.inclusive[node]
+
+            if self.recursive_calls[node]:
+                edge = edges.setdefault((callee, callee), {"calls": 0, "inclusive": 0})
+                edge["calls"] += self.recursive_calls[node]
+
+        for edge in edges.values():
+            edge["inclusive"] = max(edge["inclusive"], 0)
+        return edges
+
+    def collapsed(self, timed: bool = True) -> str:
+        """
+        Collapsed stacks in the format read by flamegraph.pl and speedscope.
+        Each stack is weighted by its exclusive time, or by its exclusive event count when timed is False.
+        """
+        weights = self.exclusive if timed else self.events
+        # A stack with no weight of its own still shows up as the parent of the stacks below it.
+        return "\n".join(
+            f"{";".join(self.path(node))} {weights[node]}"
+            for node in range(1, len(self.parents)) if weights[node] > 0
+        )
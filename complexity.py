@@ -0,0 +1,156 @@
+from typing import Callable, MutableSequence, NamedTuple
+from time import perf_counter_ns
+from math import log2, sqrt
+
+from timing import time_function
+
+__all__ = "models", "Fit", "Estimate", "fit", "estimate", "width"
+
+# Candidate complexity models as functions of the word width w and the input size n.
+models: dict[str, dict] = {
+    "constant": {"complexity": lambda w, n: 1, "readable": "1"},
+    "logarithmic": {"complexity": lambda w, n: log2(n), "readable": "log n"},
+    "linear": {"complexity": lambda w, n: n, "readable": "n"},
+    "linearithmic": {"complexity": lambda w, n: n * log2(n), "readable": "n * log n"},
+    "quadratic": {"complexity": lambda w, n: n**2, "readable": "n²"},
+    "cubic": {"complexity": lambda w, n: n**3, "readable": "n³"},
+    "word linear": {"complexity": lambda w, n: w * n, "readable": "w * n"}
+}
+
+# Two-sided 95% quantiles of Student's t distribution by degrees of freedom.
+_t_quantiles = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 30: 2.042}
+
+def _t_quantile(degrees: int) -> float:
+    for known in sorted(_t_quantiles, reverse = True):
+        if degrees >= known:
+            return _t_quantiles[known] if degrees <= 30 else 1.96
+    return _t_quantiles[1]
+
+def width(array: MutableSequence[int]) -> int:
+    """Number of decimal digits of the largest element, the w in radix sort's w * n."""
+    return len(str(max(array))) if len(array) else 1
+
+class Fit(NamedTuple):
+    model: str
+    readable: str
+    constant: float
+    interval: tuple[float, float]
+    residuals: list[float]
+    error: float
+
+class Estimate(NamedTuple):
+    sizes: list[int]
+    widths: list[int]
+    measurements: list[float]
+    fits: list[Fit]
+    metric: str
+
+    @property
+    def best(self) -> Fit:
+        return self.fits[0]
+
+    def __repr__(self) -> str:
+        unit = "ns" if self.metric == "time" else "operations"
+        best = self.best
+        result = f"Best model: O(C * {best.readable}), C = {best.constant:.4g} {unit} (95% CI {best.interval[0]:.4g} to {best.interval[1]:.4g})\n"
+        result += f"{"model":12} | {"C":>12} | {"rms relative residual":>21}\n"
+        for candidate in self.fits:
+            result += f"{candidate.model:12} | {candidate.constant:12.4g} | {candidate.error:21.4f}\n"
+        result += f"{"n":>10} | {"w":>3} | {"measured":>14} | {"residual":>9}\n"
+        for n, w, measured, residual in zip(self.sizes, self.widths, self.measurements, best.residuals):
+            result += f"{n:10} | {w:3} | {measured:14.0f} | {residual:9.4f}\n"
+        return result
+
+def fit(sizes: list[int], measurements: list[float], widths: list[int] | None = None) -> list[Fit]:
+    """
+    Fit y = C * f(w, n) for every candidate model by least squares on relative errors, so large sizes do not drown out small ones.
+    Returns the fits ordered from best to worst. Models that are zero at every size cannot be scaled to the measurements and are left out.
+    """
+    if len(set(sizes)) < 2 or len(sizes) != len(measurements):
+        raise ValueError(f"Fitting needs at least two distinct sizes and one measurement per size, got {len(set(sizes))} distinct sizes and {len(measurements)} measurements.")
+    if min(measurements) <= 0:
+        raise ValueError(f"Fitting on relative errors needs positive measurements, got {min(measurements)}.")
+    widths = widths or [1] * len(sizes)
+    fits = []
+
+    for name, model in models.items():
+        features = [model["complexity"](w, n) for w, n in zip(widths, sizes)]
+        ratios = [f / y for f, y in zip(features, measurements)]
+        squares = sum(ratio * ratio for ratio in ratios)
+        if squares == 0:
+            continue
+        constant = sum(ratios) / squares
+
+        residuals = [(y - constant * f) / y for f, y in zip(features, measurements)]
+        degrees = max(len(sizes) - 1, 1)
+        variance = sum(residual * residual for residual in residuals) / degrees
+        spread = _t_quantile(degrees) * sqrt(variance / squares)
+
+        fits.append(Fit(name, model["readable"], constant, (constant - spread, constant + spread), residuals, sqrt(variance)))
+
+    return sorted(fits, key = lambda candidate: candidate.error)
+
+def _random_input(length: int) -> list[int]:
+    from datasets import load
+    dataset = load("uniform", length)
+    data = dataset.copy()
+    dataset.close()
+    return data
+
+def estimate(
+        function: Callable,
+        make_input: Callable[[int], MutableSequence] = _random_input,
+        start: int = 64,
+        factor: float = 2,
+        max_size: int = 1 << 20,
+        repeats: int = 5,
+        warmup: int = 1,
+        metric: str = "time",
+        stable: int = 3,
+        budget: float = 60) -> Estimate:
+    """
+    Run a function over a geometric series of input sizes and fit the candidate models to the measurements.
+    The metric is either the median time in nanoseconds or the number of executed operations counted by the Evaluator.
+    Sizes stop growing once the best model has stayed the same for the given number of sizes, or once the time budget in seconds is spent.
+    """
+    if metric not in ("time", "operations"):
+        raise ValueError(f"{metric} is not a known metric. Choose from time, operations.")
+    if start < 1 or max_size <= start:
+        raise ValueError(f"Sizes must run from a positive start up to more than the start so at least two sizes can be fitted, got start {start} and max_size {max_size}.")
+
+    if metric == "operations":
+        from evaluator import Evaluator, categories
+        evaluator = Evaluator("blocks")
+        measured = evaluator.measure(function)
+
+    sizes, widths, measurements = [], [], []
+    best_models = []
+    deadline = perf_counter_ns() + budget * 1_000_000_000
+    size = start
+
+    # The first two sizes are always measured, however small the budget, so there is something to fit.
+    while size <= max_size and (len(sizes) < 2 or perf_counter_ns() < deadline):
+        array = make_input(size)
+
+        if metric == "time":
+            measurements.append(time_function(function, array, repeats, loops = 1, warmup = warmup).median)
+        else:
+            result = evaluator[function.__name__]
+            before = sum(result[category] for category in categories)
+            measured(list(array))
+            measurements.append(sum(result[category] for category in categories) - before)
+
+        sizes.append(size)
+        widths.append(width(array))
+
+        if len(sizes) >= stable + 1:
+            best_models.append(fit(sizes, measurements, widths)[0].model)
+            if len(best_models) >= stable and len(set(best_models[-stable:])) == 1:
+                break
+
+        size = max(size + 1, round(size * factor))
+
+    if metric == "operations":
+        evaluator.close()
+
+    return Estimate(sizes, widths, measurements, fit(sizes, measurements, widths), metric)
@@ -0,0 +1,133 @@
+from collections.abc import MutableSequence
+from typing import Iterable
+
+__all__ = "counted_types", "wrap", "unwrap"
+
+def counted_types() -> tuple[type, type, list[int]]:
+    """
+    Make a fresh element proxy class and sequence proxy class that count into the same list: [comparisons, reads, writes].
+    Element comparisons count one each. Sequence reads and writes count one per element, so a slice of length k counts k.
+    Arithmetic on elements gives plain values, which is all the sorts need from it.
+    Slicing the input gives another counted sequence, so a sort's accesses to the halves it slices off count too. Lists a sort builds itself are not counted,
+    though comparing the elements in them still is.
+    """
+    counts = [0, 0, 0]
+
+    class Element(object):
+        __slots__ = ("value",)
+
+        def __init__(self, value) -> None:
+            self.value = value
+
+        # Comparing two elements is the fast path. A plain value on the other side has no value attribute.
+        def __lt__(self, other) -> bool:
+            counts[0] += 1
+            try:
+                return self.value < other.value
+            except AttributeError:
+                return self.value < other
+
+        def __le__(self, other) -> bool:
+            counts[0] += 1
+            try:
+                return self.value <= other.value
+            except AttributeError:
+                return self.value <= other
+
+        def __gt__(self, other) -> bool:
+            counts[0] += 1
+            try:
+                return self.value > other.value
+            except AttributeError:
+                return self.value > other
+
+        def __ge__(self, other) -> bool:
+            counts[0] += 1
+            try:
+                return self.value >= other.value
+            except AttributeError:
+                return self.value >= other
+
+        def __eq__(self, other) -> bool:
+            counts[0] += 1
+            try:
+                return self.value == other.value
+            except AttributeError:
+                return self.value == other
+
+        def __ne__(self, other) -> bool:
+            counts[0] += 1
+            try:
+                return self.value != other.value
+            except AttributeError:
+                return self.value != other
+
+        def __hash__(self) -> int:
+            return hash(self.value)
+
+        def __index__(self) -> int:
+            return self.value.__index__()
+
+        def __int__(self) -> int:
+            return int(self.value)
+
+        def __str__(self) -> str:
+            return str(self.value)
+
+        def __repr__(self) -> str:
+            return repr(self.value)
+
+    def _binary(name: str):
+        def operation(self, other):
+            return getattr(self.value, name)(other.value if type(other) is Element else other)
+        operation.__name__ = name
+        return operation
+
+    for name in ("add", "sub", "mul", "floordiv", "truediv", "mod", "pow", "lshift", "rshift", "and", "or", "xor"):
+        setattr(Element, f"__{name}__", _binary(f"__{name}__"))
+        setattr(Element, f"__r{name}__", _binary(f"__r{name}__"))
+
+    class Sequence(MutableSequence):
+        __slots__ = ("data",)
+
+        def __init__(self, data: list) -> None:
+            self.data = data
+
+        def __getitem__(self, index):
+            if type(index) is slice:
+                items = self.data[index]
+                counts[1] += len(items)
+                return Sequence(items)
+            counts[1] += 1
+            return self.data[index]
+
+        def __setitem__(self, index, value) -> None:
+            if type(index) is slice:
+                value = list(value)
+                counts[2] += len(value)
+            else:
+                counts[2] += 1
+            self.data[index] = value
+
+        def __delitem__(self, index) -> None:
+            del self.data[index]
+
+        def __len__(self) -> int:
+            return len(self.data)
+
+        def __iter__(self):
+            counts[1] += len(self.data)
+            return iter(self.data)
+
+        def insert(self, index: int, value) -> None:
+            counts[2] += 1
+            self.data.insert(index, value)
+
+    return Element, Sequence, counts
+
+def wrap(values: Iterable, element: type, sequence: type) -> MutableSequence:
+    return sequence([element(value) for value in values])
+
+def unwrap(wrapped: MutableSequence, element: type) -> list:
+    """The plain values of a wrapped sequence, read without counting."""
+    return [value.value if type(value) is element else value for value in wrapped.data]
@@ -0,0 +1,135 @@
+import os, hashlib, inspect
+from typing import Callable
+from types import CodeType
+from array import array
+from mmap import mmap, ACCESS_READ
+from random import Random
+
+__all__ = "generators", "Dataset", "load", "cache_directory"
+
+# Integers are stored as signed 64-bit values, so every generator stays below this bound.
+LIMIT = (1 << 63) - 1
+
+def uniform(random: Random, size: int) -> list[int]:
+    return [random.randint(0, 2 * size) for _ in range(size)]
+
+def ascending(random: Random, size: int) -> list[int]:
+    return sorted(uniform(random, size))
+
+def descending(random: Random, size: int) -> list[int]:
+    return sorted(uniform(random, size), reverse = True)
+
+def nearly_sorted(random: Random, size: int, swaps: float = 0.01) -> list[int]:
+    data = ascending(random, size)
+    for _ in range(int(size * swaps)):
+        i, j = random.randrange(size), random.randrange(size)
+        data[i], data[j] = data[j], data[i]
+    return data
+
+def few_unique(random: Random, size: int, unique: int = 10) -> list[int]:
+    values = [random.randint(0, 2 * size) for _ in range(unique)]
+    return [random.choice(values) for _ in range(size)]
+
+def wide(random: Random, size: int, bits: int = 62) -> list[int]:
+    return [random.getrandbits(bits) for _ in range(size)]
+
+generators: dict[str, Callable[..., list[int]]] = {
+    "uniform": uniform,
+    "sorted": ascending,
+    "reversed": descending,
+    "nearly sorted": nearly_sorted,
+    "few unique": few_unique,
+    "wide": wide
+}
+
+def cache_directory() -> str:
+    return os.environ.get("PYRFTESTER_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "pyrftester", "datasets"))
+
+def _sources(function: Callable) -> list[str]:
+    """The source of a generator and of every function of this module it calls, directly or through other ones, e.g. uniform for nearly_sorted."""
+    sources, pending, seen = [], [function], set()
+    while pending:
+        function = pending.pop()
+        if function in seen:
+            continue
+        seen.add(function)
+        sources.append(inspect.getsource(function))
+        codes = [function.__code__]
+        while codes:
+            code = codes.pop()
+            codes.extend(constant for constant in code.co_consts if isinstance(constant, CodeType))
+            pending.extend(value for name in code.co_names if callable(value := globals().get(name)) and getattr(value, "__module__", None) == __name__)
+    return sources
+
+def _fingerprint(distribution: str, size: int, seed: int, parameters: dict) -> str:
+    # The sources of the generator and its helpers are part of the key, so editing either invalidates the cached files.
+    key = repr((distribution, size, seed, sorted(parameters.items()), _sources(generators[distribution])))
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+class Dataset(object):
+    """A cached input array of signed 64-bit integers, memory-mapped from disk. Every run should take its own copy."""
+    __slots__ = (
+        "distribution",
+        "size",
+        "seed",
+        "path",
+        "file",
+        "map"
+    )
+
+    def __init__(self, distribution: str, size: int, seed: int, path: str) -> None:
+        self.distribution = distribution
+        self.size = size
+        self.seed = seed
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap(self.file.fileno(), 0, access = ACCESS_READ) if size else None
+
+    @property
+    def view(self) -> memoryview:
+        return memoryview(self.map).cast("q") if self.map is not None else memoryview(b"").cast("q")
+
+    @property
+    def name(self) -> str:
+        return f"{self.distribution} n={self.size} seed={self.seed}"
+
+    def copy(self) -> list[int]:
+        """A fresh list with the data, for in-place sorts."""
+        with self.view as view:
+            return view.tolist()
+
+    def array(self) -> array:
+        data = array("q")
+        if self.map is not None:
+            data.frombytes(self.map)
+        return data
+
+    def tobytes(self) -> bytes:
+        return self.map[:] if self.map is not None else b""
+
+    def __len__(self) -> int:
+        return self.size
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+def load(distribution: str, size: int, seed: int = 0, directory: str | None = None, **parameters) -> Dataset:
+    """Get a dataset from the cache, generating and storing it first if it is missing or its generator changed."""
+    if distribution not in generators:
+        raise KeyError(f"{distribution} is not a known distribution. Choose from {", ".join(generators)}.")
+
+    directory = directory or cache_directory()
+    os.makedirs(directory, exist_ok = True)
+    path = os.path.join(directory, f"{distribution.replace(" ", "_")}-{size}-{seed}-{_fingerprint(distribution, size, seed, parameters)}.q")
+
+    if not os.path.exists(path):
+        data = array("q", (min(value, LIMIT) for value in generators[distribution](Random(seed), size, **parameters)))
+        # Write to a temporary name first, so concurrent runs never map a half-written file.
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            data.tofile(file)
+        os.replace(temporary, path)
+
+    return Dataset(distribution, size, seed, path)
@@ -1,8 +1,19 @@
+import sys
 from typing import Iterable, Sized, Callable, Generic, TypeVar, Self, Sequence, MutableSequence, NamedTuple, Any
 from time import perf_counter_ns
+import tracemalloc, threading
+from contextlib import contextmanager
 from sys import settrace
-from types import FrameType
+from types import FrameType, CodeType
 from random import randint
+from array import array
+from dis import get_instructions
+
+from analyser import code_objects, line_table
+from tracing import MonitoringBackend, trace_opcodes
+from blocks import BlockCounter
+from timing import Timing, summarise, time_function
+from counting import counted_types, wrap, unwrap
 
 bytecodes = {
     "MISC": [
@@ -33,6 +44,7 @@ bytecodes = {
         "DICT_UPDATE",
         "DICT_MERGE",
         "LOAD_ATTR",
+        "LOAD_SUPER_ATTR",
         "COMPARE_OP",
         "IS_OP",
         "CONTAINS_OP",
@@ -49,35 +61,56 @@ bytecodes = {
         "POP_JUMP_BACKWARD_IF_NOT_NONE",
         "POP_JUMP_FORWARD_IF_NONE",
         "POP_JUMP_BACKWARD_IF_NONE",
+        "POP_JUMP_IF_TRUE",
+        "POP_JUMP_IF_FALSE",
+        "POP_JUMP_IF_NOT_NONE",
+        "POP_JUMP_IF_NONE",
         "JUMP_IF_TRUE_OR_POP",
         "JUMP_IF_FALSE_OR_POP",
         "FOR_ITER",
+        "END_FOR",
         "LOAD_GLOBAL",
         "LOAD_FAST",
+        "LOAD_FAST_CHECK",
+        "LOAD_FAST_AND_CLEAR",
+        "LOAD_FAST_LOAD_FAST",
         "STORE_FAST",
+        "STORE_FAST_LOAD_FAST",
+        "STORE_FAST_STORE_FAST",
         "DELETE_FAST",
         "MAKE_CELL",
         "LOAD_CLOSURE",
         "LOAD_DEREF",
+        "LOAD_FROM_DICT_OR_DEREF",
+        "LOAD_FROM_DICT_OR_GLOBALS",
+        "LOAD_LOCALS",
         "LOAD_CLASSDEREF",
         "STORE_DEREF",
         "DELETE_DEREF",
         "COPY_FREE_VARS",
         "RAISE_VARARGS",
         "CALL",
+        "CALL_KW",
         "CALL_FUNCTION_EX",
         "LOAD_METHOD",
         "PRECALL",
         "PUSH_NULL",
         "KW_NAMES",
         "MAKE_FUNCTION",
+        "SET_FUNCTION_ATTRIBUTE",
         "BUILD_SLICE",
         "EXTENDED_ARG",
         "FORMAT_VALUE",
+        "FORMAT_SIMPLE",
+        "FORMAT_WITH_SPEC",
+        "CONVERT_VALUE",
         "MATCH_CLASS",
         "RESUME",
+        "CALL_INTRINSIC_1",
+        "CALL_INTRINSIC_2",
         "RETURN_GENERATOR",
         "SEND",
+        "END_SEND",
         "ASYNC_GEN_WRAP"
     ],
     "STACK": [
@@ -91,12 +124,15 @@ bytecodes = {
             "UNARY_NEGATIVE",
             "UNARY_NOT",
             "UNARY_INVERT",
+            "TO_BOOL",
         ],
         "BINARY": [
             "BINARY_OP",
 
             "BINARY_SUBSCR",
+            "BINARY_SLICE",
             "STORE_SUBSCR",
+            "STORE_SLICE",
             "DELETE_SUBSCR"
         ],
     },
@@ -111,10 +147,12 @@ bytecodes = {
             ],
             "RETURNS": [
                 "RETURN_VALUE",
+                "RETURN_CONST",
             ],
             "CONSTRUCTORS": [
                 "SETUP_ANNOTATIONS",
                 "LOAD_BUILD_CLASS",
+                "EXIT_INIT_CHECK",
             ]
         },
         "IMPORTS": [
@@ -126,6 +164,7 @@ bytecodes = {
             "PUSH_EXC_INFO",
             "CHECK_EXC_MATCH",
             "CHECK_EG_MATCH",
+            "CLEANUP_THROW",
             "PREP_RERAISE_STAR",
             "WITH_EXCEPT_START",
             "LOAD_ASSERTION_ERROR",
@@ -152,41 +191,271 @@ bytecodes = {
     },
 }
 
+# Operation categories counted by the Evaluator, in the order of their counter slots.
+categories = ("comparisons", "memory access", "memory mutations", "helper calls", "other")
+OTHER = categories.index("other")
+
+def _opnames(taxonomy: dict | list) -> list[str]:
+    if isinstance(taxonomy, list):
+        return taxonomy
+    return [opname for group in taxonomy.values() for opname in _opnames(group)]
+
+def _categorise(opname: str) -> int:
+    if opname in ("COMPARE_OP", "IS_OP", "CONTAINS_OP"):
+        return categories.index("comparisons")
+    if opname.startswith("LOAD_") or opname in ("BINARY_SUBSCR", "BINARY_SLICE"):
+        return categories.index("memory access")
+    if opname.startswith(("STORE_", "DELETE_")) or opname in bytecodes["CALLS"]["SEQUENCES"]["MUTATIONS"]:
+        return categories.index("memory mutations")
+    if opname in ("CALL", "CALL_KW", "CALL_FUNCTION_EX", "PRECALL"):
+        return categories.index("helper calls")
+    return OTHER
+
+opcode_categories: dict[str, int] = {opname: _categorise(opname) for opname in _opnames(bytecodes)}
+
+def category_table(code: CodeType) -> array:
+    """Map every instruction offset of a code object to the counter slot of its operation category."""
+    table = array("B", [OTHER]) * len(code.co_code)
+    for instruction in get_instructions(code):
+        table[instruction.offset] = opcode_categories.get(instruction.opname, OTHER)
+    return table
+
+class _LineMemory(object):
+    """
+    Bytes allocated and peak bytes per source line of a set of code objects, measured with tracemalloc at every LINE event.
+    The tracemalloc peak since the previous event is charged to the line that ran in between. Its rise over the level when that line started
+    is what the line allocated, including memory it freed again, and its height over the level when tracing started is the line's peak.
+    Allocations in untraced callees are charged to the line that called them.
+    """
+    __slots__ = (
+        "codes",
+        "lines",
+        "baseline",
+        "level",
+        "highest",
+        "own",
+        "running",
+        "tool_id"
+    )
+
+    def __init__(self, codes: list[CodeType]) -> None:
+        self.codes = codes
+        self.lines: dict[int, dict[str, int]] = {line: {"allocated": 0, "peak": 0} for code in codes for line in line_table(code) if line}
+        self.baseline = self.level = self.highest = self.own = 0
+        self.running: int | None = None
+        self.tool_id: int | None = None
+
+    def on_line(self, code: CodeType | None, line_number: int | None) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        if self.running is not None:
+            line = self.lines.setdefault(self.running, {"allocated": 0, "peak": 0})
+            line["allocated"] += max(peak - self.level - self.own, 0)
+            line["peak"] = max(line["peak"], peak - self.baseline)
+        self.highest = max(self.highest, peak)
+        self.running = line_number
+        # The peak is reset last, so the bookkeeping above is not charged to the next line.
+        tracemalloc.reset_peak()
+        self.level = tracemalloc.get_traced_memory()[0]
+
+    def start(self) -> None:
+        monitoring = sys.monitoring
+        self.tool_id = MonitoringBackend.free_tool_id()
+        monitoring.use_tool_id(self.tool_id, "pyrftester memory")
+        monitoring.register_callback(self.tool_id, monitoring.events.LINE, self.on_line)
+        # Reading the level allocates a little, which shows up in the next peak. That much is left out of every line.
+        tracemalloc.reset_peak()
+        self.level = tracemalloc.get_traced_memory()[0]
+        self.own = tracemalloc.get_traced_memory()[1] - self.level
+        tracemalloc.reset_peak()
+        self.baseline = self.level = self.highest = tracemalloc.get_traced_memory()[0]
+        for code in self.codes:
+            monitoring.set_local_events(self.tool_id, code, monitoring.events.LINE)
+
+    def stop(self) -> None:
+        monitoring = sys.monitoring
+        for code in self.codes:
+            monitoring.set_local_events(self.tool_id, code, monitoring.events.NO_EVENTS)
+        # Charge whatever ran after the last line event to that line.
+        self.on_line(None, None)
+        monitoring.register_callback(self.tool_id, monitoring.events.LINE, None)
+        monitoring.free_tool_id(self.tool_id)
+        self.tool_id = None
+
 class Evaluator(object):
-    def __init__(self) -> None:
+    def __init__(self, backend: str = "auto", memory: str = "none") -> None:
 
         self.results = {}
 
+        # Memory measurement with tracemalloc: none, peak and net bytes per call, or those plus allocated and peak bytes per source line.
+        if memory not in ("none", "peak", "lines"):
+            raise KeyError(f"{memory} is not a known memory mode. Choose from none, peak, lines.")
+        self.memory = memory
+
+        # Counter slots of every measured function, and the category table and owning function of every measured code object keyed by its id.
+        self.counters: dict[int, list[int]] = {}
+        self.tables: dict[int, tuple[array, int]] = {}
+
+        # Instrumentation is only on while a measured call runs. Every thread counts into its own slots, which are merged into counters when its outermost scope ends.
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.active = 0
+
+        if backend == "auto":
+            backend = "monitoring" if MonitoringBackend.available() else "settrace"
+        self.backend = backend
+        self.tool_id: int | None = None
+
+        # In blocks mode only block entries are counted, and the category totals are rebuilt from per-block histograms.
+        self.block_counter: BlockCounter | None = None
+        self.function_codes: dict[int, list[CodeType]] = {}
+        self.block_histograms: dict[int, list[list[int]]] = {}
+
+        local = self.local
+
+        # The monitoring tool ID is taken when the first scope starts and given back when the last one ends, so any number of Evaluators can exist at once.
+        if backend == "monitoring":
+
+            def on_instruction(code: CodeType, offset: int) -> None:
+                # Threads outside a scope have no slots, so code they run while another thread measures is not counted.
+                # Neither is code added after the thread's scope started.
+                try:
+                    table, counts = local.slots[id(code)]
+                except (AttributeError, KeyError):
+                    return
+                counts[table[offset]] += 1
+
+            self.on_instruction = on_instruction
+
+        elif backend == "blocks":
+            self.block_counter = BlockCounter("pyrftester evaluator")
+
+        # In elements mode nothing is traced. measure hands the function proxies of the input and its elements instead,
+        # which count comparisons as comparisons, and reads and writes of the input as memory accesses and mutations.
+        elif backend not in ("settrace", "elements", "none"):
+            raise KeyError(f"{backend} is not a known counting backend. Choose from monitoring, settrace, blocks, elements, none.")
+
+    def _tracer(self, slots: dict[int, tuple[array, list[int]]]) -> Callable:
+        armed: set[int] = set()
+
         def tracer(call_frame: FrameType, *_):
-            tag = False
-            if call_frame.f_back and "evaluator_measure_id_number" in call_frame.f_back.f_locals:
-                id_num = call_frame.f_back.f_locals["evaluator_function_id_number"]
-                self.results[id_num]["calls"] += 1
-                call_frame.f_trace_opcodes = True
-                call_frame.f_trace_lines = False
-                tag = True
+            slot = slots.get(id(call_frame.f_code))
+            if slot is None:
+                return None
+            table, counts = slot
 
             def inner(frame: FrameType, event: str, arg: Any):
-                code = frame.f_lasti
-
-                """if code in ("COMPARE_OP", "BINARY_OP"):
-                    self.results[id_num]["comparisons"] += 1
-                elif code in ("LOAD_FAST", "LOAD_ATTR", "LOAD_CONST", "LOAD_GLOBAL", "LOAD_METHOD", "BINARY_SUBSCR"):
-                    self.results[id_num]["memory access"] += 1
-                elif code in ("STORE_ATTR", "STORE_FAST", "STORE_SUBSCR"):
-                    self.results[id_num]["memory mutations"] += 1
-                elif code in ("CALLS", "PRECALL"):
-                    self.results[id_num]["helper calls"] += 1
-                else:
-                    self.codes.add(code)
-                    self.results[id_num]["other"] += 1"""
-
+                if event == "opcode":
+                    counts[table[frame.f_lasti]] += 1
                 return inner
 
-            if tag:
-                return inner
+            # Opcode tracing only takes effect on frames that already have a local trace function.
+            call_frame.f_trace = inner
+            call_frame.f_trace_lines = False
+            trace_opcodes(call_frame, armed)
+            return inner
+
+        return tracer
 
-        settrace(tracer)
+    def _set_events(self, codes: Iterable[CodeType], events: int) -> None:
+        for code in codes:
+            sys.monitoring.set_local_events(self.tool_id, code, events)
+
+    def _acquire(self) -> None:
+        monitoring = sys.monitoring
+        self.tool_id = MonitoringBackend.free_tool_id()
+        monitoring.use_tool_id(self.tool_id, "pyrftester evaluator")
+        monitoring.register_callback(self.tool_id, monitoring.events.INSTRUCTION, self.on_instruction)
+        self._set_events((code for codes in self.function_codes.values() for code in codes), monitoring.events.INSTRUCTION)
+
+    def _release(self) -> None:
+        monitoring = sys.monitoring
+        self._set_events((code for codes in self.function_codes.values() for code in codes), monitoring.events.NO_EVENTS)
+        monitoring.register_callback(self.tool_id, monitoring.events.INSTRUCTION, None)
+        monitoring.free_tool_id(self.tool_id)
+        self.tool_id = None
+
+    @contextmanager
+    def scope(self):
+        """
+        Count operations of the measured functions that this thread runs inside the block.
+        Scopes nest, and every thread may have its own at the same time. Its counts are added to the totals when its outermost scope ends.
+        """
+        local = self.local
+        depth = getattr(local, "depth", 0)
+        local.depth = depth + 1
+        if depth:
+            try:
+                yield self
+            finally:
+                local.depth = depth
+            return
+
+        with self.lock:
+            thread_counters = {function_id: [0] * len(categories) for function_id in self.counters}
+            local.counters = thread_counters
+            local.slots = {code_id: (table, thread_counters[function_id]) for code_id, (table, function_id) in self.tables.items()}
+            self.active += 1
+            if self.active == 1 and self.backend == "monitoring":
+                self._acquire()
+
+        if self.block_counter is not None:
+            self.block_counter.enter()
+
+        previous = None
+        if self.backend == "settrace":
+            previous = sys.gettrace()
+            settrace(self._tracer(local.slots))
+
+        try:
+            yield self
+        finally:
+            if self.backend == "settrace":
+                settrace(previous)
+            if self.block_counter is not None:
+                self.block_counter.exit()
+
+            with self.lock:
+                for function_id, counts in thread_counters.items():
+                    totals = self.counters[function_id]
+                    for category, count in enumerate(counts):
+                        totals[category] += count
+                self.active -= 1
+                if self.active == 0 and self.tool_id is not None:
+                    self._release()
+
+            del local.slots, local.counters
+            local.depth = 0
+
+    def close(self) -> None:
+        """Stop counting and release the monitoring tool ID, if a scope still holds it."""
+        if self.tool_id is not None:
+            self._release()
+        elif self.block_counter is not None:
+            self.block_counter.close()
+            self.block_counter = None
+
+    def __enter__(self) -> "Evaluator":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if getattr(self, "tool_id", None) is not None and hasattr(sys, "monitoring"):
+            self._release()
+
+    def category_counts(self, function: Callable) -> list[int]:
+        """Operation counts of a measured function in the order of categories."""
+        if self.block_counter is None:
+            return list(self.counters[id(function)])
+
+        counts = [0] * len(categories)
+        for code in self.function_codes[id(function)]:
+            for histogram, entries in zip(self.block_histograms[id(code)], self.block_counter.counts[id(code)]):
+                if entries:
+                    for category, count in enumerate(histogram):
+                        counts[category] += count * entries
+        return counts
 
     """Add a new algorithm function to test."""
 
@@ -204,11 +473,29 @@ class Evaluator(object):
                 "memory access": 0,
                 "memory mutations": 0,
                 "memory usage": [],
+                "memory lines": {},
                 "other": 0,
-                "time": 0,
+                "time": [],
                 "valid": False
             }
 
+            # Every code object of the function, nested functions included, counts into the same slots.
+            # Functions added while a scope is open are counted from the next scope on.
+            with self.lock:
+                self.counters[id(function)] = [0] * len(categories)
+                self.function_codes[id(function)] = code_objects(function.__code__)
+                for code in self.function_codes[id(function)]:
+                    self.tables[id(code)] = (category_table(code), id(function))
+                if self.active and self.tool_id is not None:
+                    self._set_events(self.function_codes[id(function)], sys.monitoring.events.INSTRUCTION)
+            for code in self.function_codes[id(function)]:
+                if self.block_counter is not None:
+                    self.block_counter.add(code)
+                    self.block_histograms[id(code)] = [
+                        [sum(opcode_categories.get(instruction.opname, OTHER) == category for instruction in block.instructions) for category in range(len(categories))]
+                        for block in self.block_counter.blocks[id(code)]
+                    ]
+
     """Decorate a function in order to measure details about an algorithm."""
 
     def measure(self, algorithm: Callable) -> Callable:
@@ -217,15 +504,66 @@ class Evaluator(object):
 
         def inner(iterable: MutableSequence):
 
-            # Needed to get the IDs from tracing.
-            evaluator_function_id_number = id(algorithm)
-            evaluator_measure_id_number = id(self.measure)
+            # The input is wrapped before the memory baseline is taken, so its proxies do not count as memory the algorithm uses.
+            if self.backend == "elements":
+                element, sequence, element_counts = counted_types()
+                argument = wrap(iterable, element, sequence)
+            else:
+                argument = iterable
+
+            memory = self.memory != "none"
+            line_memory = _LineMemory(self.function_codes[id(algorithm)]) if self.memory == "lines" else None
+            if memory:
+                tracing = tracemalloc.is_tracing()
+                if not tracing:
+                    tracemalloc.start()
+            # tracemalloc is stopped again however the measured call ends.
+            try:
+                if memory:
+                    tracemalloc.reset_peak()
+                    baseline = tracemalloc.get_traced_memory()[0]
+
+                with self.scope():
+                    if line_memory is not None:
+                        line_memory.start()
+                    try:
+                        start = perf_counter_ns()
+                        sorted_result = algorithm(argument)
+                        end = perf_counter_ns()
+                    finally:
+                        if line_memory is not None:
+                            line_memory.stop()
+                if memory:
+                    current, peak = tracemalloc.get_traced_memory()
+                    # Line tracing resets the peak at every line, so the highest peak it saw counts as well.
+                    if line_memory is not None:
+                        peak = max(peak, line_memory.highest)
+            finally:
+                if memory and not tracing:
+                    tracemalloc.stop()
+
+            if self.backend == "elements":
+                for index, value in enumerate(unwrap(argument, element)):
+                    iterable[index] = value
+                if sorted_result is argument:
+                    sorted_result = iterable
+                with self.lock:
+                    totals = self.counters[id(algorithm)]
+                    for category, count in zip(("comparisons", "memory access", "memory mutations"), element_counts):
+                        totals[categories.index(category)] += count
 
-            start = perf_counter_ns()
-            sorted_result = algorithm(iterable)
-            end = perf_counter_ns()
+            result = self.results[id(algorithm)]
+            with self.lock:
+                result["time"].append(end - start)
+                result["calls"] += 1
+            for category, count in zip(categories, self.category_counts(algorithm)):
+                result[category] = count
 
-            self.results[id(algorithm)]["time"] = end - start
+            if memory:
+                # The input is allocated before the baseline, so both figures are auxiliary space beyond it.
+                result["memory usage"].append({"peak": peak - baseline, "net": current - baseline})
+                if line_memory is not None:
+                    result["memory lines"] = dict(sorted(line_memory.lines.items()))
 
             # Validation
             for i in range(len(iterable) - 1):
@@ -238,6 +576,17 @@ class Evaluator(object):
 
         return inner
 
+    """Time an algorithm with repeats on fresh copies of the input and add the samples to its time distribution."""
+
+    def time(self, algorithm: Callable, iterable: MutableSequence, repeats: int = 7, loops: int | None = None, disable_gc: bool = True) -> Timing:
+
+        self.add_function(algorithm)
+
+        timing = time_function(algorithm, iterable, repeats, loops, disable_gc = disable_gc)
+        self.results[id(algorithm)]["time"].extend(timing.samples)
+
+        return timing
+
     """Get the results from the name or ID of the function."""
 
     def __getitem__(self, item: str | Callable) -> dict:
@@ -258,9 +607,10 @@ class Evaluator(object):
         algorithm = self[item]
 
         if len(algorithm["memory usage"]) == 0:
-            memory = 0
+            peak = net = 0
         else:
-            memory = sum(values for memory in algorithm["memory usage"] for values in memory.values()) // len(algorithm["memory usage"])
+            peak = sum(memory["peak"] for memory in algorithm["memory usage"]) // len(algorithm["memory usage"])
+            net = sum(memory["net"] for memory in algorithm["memory usage"]) // len(algorithm["memory usage"])
         representation = f"""{algorithm["name"]}:
     File: {algorithm["file"]}
     Line: {algorithm["line"]}
@@ -270,8 +620,8 @@ class Evaluator(object):
         Comparisons: {algorithm["comparisons"]}
         Memory accesses: {algorithm["memory access"]}
         Memory mutations: {algorithm["memory mutations"]}
-        Memory usage: {memory} bytes
+        Memory usage: {peak} bytes peak, {net} bytes net
         Other operations: {algorithm["other"]}
-        Time: {algorithm["time"] / 1_000_000} ms
+        Time: {summarise(algorithm["time"])}
     Validation: {"Passed" if algorithm["valid"] else "Failed"}"""
         return representation
@@ -0,0 +1,213 @@
+from array import array
+from mmap import mmap, ACCESS_READ
+from collections import Counter
+from itertools import compress
+from tempfile import TemporaryFile
+from typing import Iterator
+
+from tracing import Event, event_codes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = "EventBuffer", "event_codes"
+
+type Chunk = tuple[array | memoryview, array | memoryview, array | memoryview | None]
+
+class EventBuffer(object):
+    """
+    Columnar store of traced events.
+    Offsets, event codes and optional nanosecond timestamps are kept in separate typed arrays.
+    Full chunks are kept in memory until spill_after events have been stored, after which they are written to a memory-mapped file.
+    """
+    __slots__ = (
+        "timestamps",
+        "chunk_size",
+        "spill_after",
+        "directory",
+        "offsets",
+        "events",
+        "times",
+        "chunks",
+        "spilled",
+        "file",
+        "map",
+        "stored"
+    )
+
+    def __init__(self, timestamps: bool = False, chunk_size: int = 1 << 16, spill_after: int = 1 << 24, directory: str | None = None) -> None:
+        self.timestamps = timestamps
+        self.chunk_size = chunk_size
+        self.spill_after = spill_after
+        self.directory = directory
+
+        # The active chunk being appended to.
+        self.offsets = array("I")
+        self.events = array("B")
+        self.times = array("Q") if timestamps else None
+
+        # Full chunks held in memory, and (position, length) of chunks spilled to disk.
+        self.chunks: list[tuple[array, array, array | None]] = []
+        self.spilled: list[tuple[int, int]] = []
+        self.file = None
+        self.map: mmap | None = None
+        self.stored = 0
+
+    def append(self, offset: int, event: int, timestamp: int = 0) -> None:
+        self.offsets.append(offset)
+        self.events.append(event)
+        if self.times is not None:
+            self.times.append(timestamp)
+        if len(self.offsets) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.offsets:
+            return
+        # The active columns are copied out and emptied rather than replaced, since tracing hooks hold on to their append methods.
+        chunk = (self.offsets[:], self.events[:], self.times[:] if self.times is not None else None)
+        self.stored += len(self.offsets)
+
+        if self.stored > self.spill_after:
+            self.spill(chunk)
+        else:
+            self.chunks.append(chunk)
+
+        del self.offsets[:], self.events[:]
+        if self.times is not None:
+            del self.times[:]
+
+    def spill(self, chunk: tuple[array, array, array | None]) -> None:
+        if self.file is None:
+            self.file = TemporaryFile(dir = self.directory)
+        self.file.seek(0, 2)
+        self.spilled.append((self.file.tell(), len(chunk[0])))
+        for column in chunk:
+            if column is not None:
+                column.tofile(self.file)
+        self.file.flush()
+
+        # The file grew, so any existing mapping is stale. It is released once no views refer to it.
+        self.map = None
+
+    def __len__(self) -> int:
+        return self.stored + len(self.offsets)
+
+    def chunk_columns(self) -> Iterator[Chunk]:
+        """Yield the (offsets, events, timestamps) columns of every chunk in recording order."""
+        yield from self.chunks
+
+        if self.spilled:
+            if self.map is None:
+                self.map = mmap(self.file.fileno(), 0, access = ACCESS_READ)
+            view = memoryview(self.map)
+            offset_size = self.offsets.itemsize
+            for position, length in self.spilled:
+                offsets = view[position:position + length * offset_size].cast("I")
+                position += length * offset_size
+                events = view[position:position + length].cast("B")
+                position += length
+                times = view[position:position + length * 8].cast("Q") if self.timestamps else None
+                yield offsets, events, times
+
+        if self.offsets:
+            yield self.offsets, self.events, self.times
+
+    def counts(self, event: Event) -> Counter[int]:
+        """Count the occurrences of each offset for a single event type."""
+        code = event_codes[event]
+        counter = Counter()
+        for offsets, events, _ in self.chunk_columns():
+            counter.update(compress(offsets, map(code.__eq__, events)))
+        return counter
+
+    def offset_counts(self, event: Event, size: int) -> list[int]:
+        """Histogram of the offsets recorded for a single event type, indexed by offset. Offsets at or past size are ignored."""
+        code = event_codes[event]
+
+        if numpy is not None:
+            histogram = numpy.zeros(size, dtype = numpy.int64)
+            for offsets, events, _ in self.chunk_columns():
+                if len(offsets) == 0:
+                    continue
+                selected = numpy.frombuffer(offsets, dtype = numpy.uint32)[numpy.frombuffer(events, dtype = numpy.uint8) == code]
+                histogram += numpy.bincount(selected, minlength = size)[:size]
+            return histogram.tolist()
+
+        histogram = [0] * size
+        for offset, count in self.counts(event).items():
+            if offset < size:
+                histogram[offset] += count
+        return histogram
+
+    def offset_times(self, size: int, overhead: list[float] | None = None) -> list[int]:
+        """
+        Nanoseconds from each event to the next one, summed per offset of the earlier event.
+        The tracer overhead of the earlier event, indexed by its event code, is subtracted from each of them, and offsets at or past size are ignored.
+        """
+        if not self.timestamps:
+            raise ValueError("The events were recorded without timestamps.")
+        overhead = overhead or [0.0] * len(event_codes)
+
+        if numpy is not None:
+            costs = numpy.asarray(overhead, dtype = numpy.float64)
+            totals = numpy.zeros(size, dtype = numpy.float64)
+            previous_offset = previous_event = previous_time = None
+            for offsets, events, times in self.chunk_columns():
+                if len(offsets) == 0:
+                    continue
+                offsets = numpy.frombuffer(offsets, dtype = numpy.uint32)
+                events = numpy.frombuffer(events, dtype = numpy.uint8)
+                times = numpy.frombuffer(times, dtype = numpy.uint64).astype(numpy.int64)
+
+                # Carry the last event of the previous chunk over, so no delta is lost at chunk borders.
+                if previous_offset is None:
+                    sources = offsets[:-1]
+                    source_events = events[:-1]
+                    deltas = numpy.diff(times)
+                else:
+                    sources = numpy.concatenate(((previous_offset,), offsets[:-1]))
+                    source_events = numpy.concatenate(((previous_event,), events[:-1]))
+                    deltas = numpy.diff(times, prepend = previous_time)
+                previous_offset, previous_event, previous_time = offsets[-1], events[-1], times[-1]
+
+                inside = sources < size
+                totals += numpy.bincount(sources[inside], weights = deltas[inside] - costs[source_events[inside]], minlength = size)[:size]
+            return numpy.maximum(totals, 0).round().astype(numpy.int64).tolist()
+
+        totals = [0.0] * size
+        previous_offset = previous_event = previous_time = None
+        for offsets, events, times in self.chunk_columns():
+            for offset, event, time in zip(offsets, events, times):
+                if previous_offset is not None and previous_offset < size:
+                    totals[previous_offset] += time - previous_time - overhead[previous_event]
+                previous_offset, previous_event, previous_time = offset, event, time
+        return [max(round(total), 0) for total in totals]
+
+    def select(self, *selected: Event) -> Iterator[tuple[int, int, int, int]]:
+        """Yield (index, offset, event code, timestamp) for the selected event types only. The timestamp is 0 when none were recorded."""
+        wanted = {event_codes[event] for event in selected}
+        index = 0
+        for offsets, events, times in self.chunk_columns():
+            for position in compress(range(len(offsets)), map(wanted.__contains__, events)):
+                yield index + position, offsets[position], events[position], 0 if times is None else times[position]
+            index += len(offsets)
+
+    def count(self, event: Event) -> int:
+        code = event_codes[event]
+        return sum(bytes(events).count(code) for _, events, _ in self.chunk_columns())
+
+    def offsets_of(self, event: Event) -> Iterator[int]:
+        code = event_codes[event]
+        for offsets, events, _ in self.chunk_columns():
+            for offset, current in zip(offsets, events):
+                if current == code:
+                    yield offset
+
+    def close(self) -> None:
+        self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
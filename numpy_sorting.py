@@ -0,0 +1,108 @@
+from typing import MutableSequence
+
+import numpy
+
+__all__ = "insertion_sort", "merge_sort", "radix_sort", "quick_sort"
+
+# Segments up to this length are handed to a single vectorised call instead of being split further.
+BLOCK = 64
+
+def _load(array: MutableSequence[int]) -> numpy.ndarray:
+    return array if isinstance(array, numpy.ndarray) else numpy.asarray(array, dtype = numpy.int64)
+
+def _store(array: MutableSequence[int], result: numpy.ndarray) -> None:
+    # Sort in place like the pure-Python versions: ndarrays get the values copied in, other sequences are refilled.
+    if isinstance(array, numpy.ndarray):
+        if result is not array:
+            array[...] = result
+    else:
+        array[:] = result.tolist()
+
+def insertion_sort(array: MutableSequence[int]) -> None:
+    """Block insertion sort: each block of new elements is sorted, then inserted into the sorted prefix at positions found by binary search."""
+    values = _load(array)
+    result = numpy.sort(values[:BLOCK])
+    for start in range(BLOCK, len(values), BLOCK):
+        block = numpy.sort(values[start:start + BLOCK])
+        result = numpy.insert(result, numpy.searchsorted(result, block, side = "right"), block)
+    _store(array, result)
+
+def _merge(left: numpy.ndarray, right: numpy.ndarray, out: numpy.ndarray) -> None:
+    # Every element's final position is its own index plus the number of elements before it in the other run.
+    out[numpy.arange(len(left)) + numpy.searchsorted(right, left, side = "left")] = left
+    out[numpy.arange(len(right)) + numpy.searchsorted(left, right, side = "right")] = right
+
+def merge_sort(array: MutableSequence[int]) -> None:
+    """Bottom-up merge sort: runs of BLOCK elements are sorted in one call, then merged pairwise with doubling widths between two buffers."""
+    values = _load(array)
+    length = len(values)
+    source = values.copy()
+
+    full = length - length % BLOCK
+    if full:
+        source[:full] = numpy.sort(source[:full].reshape(-1, BLOCK), axis = 1).ravel()
+    source[full:] = numpy.sort(source[full:])
+
+    target = numpy.empty_like(source)
+    width = BLOCK
+    while width < length:
+        for start in range(0, length, 2 * width):
+            middle, end = min(start + width, length), min(start + 2 * width, length)
+            _merge(source[start:middle], source[middle:end], target[start:end])
+        source, target = target, source
+        width *= 2
+
+    _store(array, source)
+
+def radix_sort(array: MutableSequence[int]) -> None:
+    """
+    LSD radix sort in base 256 on the unsigned 64-bit keys.
+    Digits are counted with bincount; passes where every key has the same digit are skipped, and the others reorder the keys by a stable sort of the 8-bit digits, which NumPy runs as a counting sort.
+    """
+    values = _load(array)
+    if len(values) < 2:
+        return
+
+    # Keys are offsets from the minimum, which wrap into unsigned order and need only as many bytes as the value range.
+    values = values.astype(numpy.int64, copy = False)
+    minimum = values.min()
+    keys = (values - minimum).view(numpy.uint64)
+    length = len(keys)
+    passes = (int(keys.max()).bit_length() + 7) // 8
+
+    for shift in range(0, 8 * passes, 8):
+        digits = ((keys >> numpy.uint64(shift)) & numpy.uint64(0xFF)).astype(numpy.uint8)
+        counts = numpy.bincount(digits, minlength = 256)
+        if counts.max() == length:
+            continue
+        # Scattering each key to the cumsum of the counts plus its rank among the keys with the same digit needs that rank, which NumPy can only
+        # produce with a sort or an n by 256 table of counts. A stable argsort of 8-bit keys is NumPy's radix sort, a counting sort in linear time.
+        keys = keys[numpy.argsort(digits, kind = "stable")]
+
+    _store(array, keys.view(numpy.int64) + minimum)
+
+def quick_sort(array: MutableSequence[int]) -> None:
+    """Quick sort with three-way partitions by boolean masks. Segments of at most BLOCK elements are sorted in a single call."""
+    values = _load(array)
+    result = values.copy()
+    stack = [(0, len(result))]
+
+    while stack:
+        start, end = stack.pop()
+        segment = result[start:end]
+        if end - start <= BLOCK:
+            segment.sort()
+            continue
+
+        pivot = numpy.sort(segment[[0, (end - start) // 2, -1]])[1]
+        lower, upper = segment[segment < pivot], segment[segment > pivot]
+        equal = end - start - len(lower) - len(upper)
+
+        segment[:len(lower)] = lower
+        segment[len(lower):len(lower) + equal] = pivot
+        segment[len(lower) + equal:] = upper
+
+        stack.append((start, start + len(lower)))
+        stack.append((start + len(lower) + equal, end))
+
+    _store(array, result)
@@ -1,51 +1,151 @@
-from typing import Callable, Any
-from types import FrameType
-from time import perf_counter
-from sys import settrace
-from dis import get_instructions, Instruction, Bytecode
+from typing import Callable, Iterable, Any
+from types import CodeType
+from time import perf_counter, perf_counter_ns
+from dis import Instruction, Bytecode
 from inspect import getsourcelines
 from functools import cached_property
-from enum import StrEnum
-
-class Event(StrEnum):
-    CALL = "call" # profile and trace
-    LINE = "line" # trace
-    RETURN = "return" # profile and trace
-    EXCEPTION = "exception" # trace
-    C_CALL = "c_call" # profile
-    C_RETURN = "c_return" # profile
-    C_EXCEPTION = "c_exception" # profile
-    OPCODE = "opcode" # trace
+from statistics import median
+
+from analyser import Analyser, analysis, code_objects, flat_tables
+from tracing import Event, Backend, get_backend, event_codes
+from events import EventBuffer
+from stream import TraceWriter, TraceReader, codes_digest
+from calltree import CallTree
+
+# Measured tracer overhead in nanoseconds per event, indexed by event code, per backend and event selection.
+calibrations: dict[tuple[str, bool, bool, bool], list[float]] = {}
+
+def _calibration_loop(iterations: int) -> int:
+    total = 0
+    for i in range(iterations):
+        total += i
+    return total
+
+def _calibration_leaf(total: int) -> int:
+    return total + 1
+
+def _calibration_calls(iterations: int) -> int:
+    total = 0
+    for _ in range(iterations):
+        total = _calibration_leaf(total)
+    return total
 
 class Profiler(Callable):
 
-    def __init__(self, function: Callable) -> None:
+    def __init__(self, function: Callable, backend: str | Backend = "auto", lines: bool = True, opcodes: bool = False, jumps: bool = False, callees: Iterable[Callable] = (), spill_after: int = 1 << 24, timestamps: bool = False, calibrate: bool = True, stream: str | None = None) -> None:
         self.function = function
         self.timings: list[dict] = []
+        self.spill_after = spill_after
+        self.timestamps = timestamps
+
+        # With stream set, events are written to a compressed trace file while the function runs instead of kept in memory.
+        # The path may contain {run}, which is replaced by the index of the run.
+        self.stream = stream
 
         self.bytecode: Bytecode = Bytecode(function)
-        self.instructions: list[Instruction] = list(get_instructions(function))
+        self.instructions: list[Instruction] = analysis(function.__code__)["instructions"]
+
+        self.backend: Backend = get_backend(backend, lines, opcodes, jumps)
+
+        # Trace the function, its nested functions and any explicitly given callees.
+        self.function_codes: list[CodeType] = code_objects(function.__code__)
+        self.code_list: list[CodeType] = list(dict.fromkeys(self.function_codes + [code for callee in callees for code in code_objects(callee.__code__)]))
+        self.codes: set[CodeType] = set(self.code_list)
+
+        # Events are stored with a flat offset: the offset inside the code object plus the base of that code object.
+        self.bases, self.line_table, self.code_table = flat_tables(self.code_list)
+
+        self.overhead: list[float] = self.calibrate() if timestamps and calibrate else [0.0] * len(Event)
 
     def __call__(self, *args, **kwargs) -> Any:
 
-        self.timings.append({"operations": []})
+        if self.stream is None:
+            operations = EventBuffer(timestamps = self.timestamps, spill_after = self.spill_after)
+        else:
+            path = self.stream.format(run = len(self.timings))
+            operations = TraceWriter(path, self.code_list, timestamps = self.timestamps, overhead = self.overhead)
+        self.timings.append({"operations": operations, "overhead": self.overhead})
 
+        self.backend.start(self.codes, self.bases, operations, perf_counter_ns if self.timestamps else None)
         start = perf_counter()
-        settrace(self._trace_function)
-        self.function(*args, **kwargs)
-        settrace(None)
-        end = perf_counter()
+        try:
+            result = self.function(*args, **kwargs)
+        finally:
+            end = perf_counter()
+            self.backend.stop()
+            if self.stream is None:
+                operations.flush()
+            else:
+                operations.close(end - start)
+                self.timings[-1]["operations"] = TraceReader(path)
 
         self.timings[-1]["time"] = end - start
 
-        return self.timings[-1]["operations"].pop()[2]
+        return result
+
+    def replay(self, path: str) -> int:
+        """
+        Add a trace saved with stream as a new run without calling the function again, and return its run index.
+        The trace must come from the same code objects, in the same order, as this profiler traces.
+        """
+        trace = TraceReader(path)
+        if trace.codes != codes_digest(self.code_list):
+            raise ValueError(f"{path} was recorded from different code than {self.function.__qualname__}: {", ".join(trace.names)}.")
+        if trace.timestamps and not self.timestamps:
+            self.timestamps = True
+        # The trace keeps the overhead calibrated when it was recorded, which is what its times have to be corrected by.
+        self.timings.append({"operations": trace, "time": trace.time, "overhead": trace.overhead})
+        return len(self.timings) - 1
+
+    def calibrate(self, iterations: int = 10_000, repeats: int = 7, tolerance: float = 0.5) -> list[float]:
+        """
+        Measure the tracer's own cost per event for this backend and event selection, separately for every event type.
+        Line, opcode and jump events are measured on a small loop traced with only that type on, and calls and returns on a loop of calls with no other events.
+        The overhead of a type is the median extra time of a traced run over the bare run before it, divided by the number of events of that type.
+        The overheads are then checked on the loop of calls traced with the full selection. When the corrected time is further than tolerance from the bare time,
+        subtracting them would make times up rather than correct them, so no overhead is subtracted.
+        """
+        backend = self.backend
+        key = (backend.name, backend.lines, backend.opcodes, backend.jumps)
+        if key in calibrations:
+            return calibrations[key]
+
+        def extra(function: Callable, lines: bool, opcodes: bool, jumps: bool) -> tuple[float, list[int]]:
+            """
+            Median extra time of a traced run over a bare run, and the number of events of each type in a traced run.
+            Bare and traced runs take turns, so a machine that gets slower or faster in between shifts both.
+            """
+            samples = []
+            for _ in range(repeats):
+                start = perf_counter_ns()
+                function(iterations)
+                bare = perf_counter_ns() - start
+                profiler = Profiler(function, type(backend)(lines, opcodes, jumps), callees = (_calibration_leaf,), timestamps = True, calibrate = False)
+                profiler(iterations)
+                samples.append(sum(profiler.offset_times()) - bare)
+            return median(samples), [profiler.timings[0]["operations"].count(event) for event in Event]
 
-    def _trace_function(self, frame: FrameType, code: str, arg: Any) -> None:
-        frame.f_trace_lines = True
-        frame.f_trace_opcodes = True
+        overhead = [0.0] * len(Event)
+        for event, selected, switches in ((Event.LINE, backend.lines, (True, False, False)), (Event.OPCODE, backend.opcodes, (False, True, False)), (Event.JUMP, backend.jumps, (False, False, True))):
+            if selected:
+                time, counts = extra(_calibration_loop, *switches)
+                overhead[event_codes[event]] = max(time, 0) / max(counts[event_codes[event]], 1)
 
-        frame.f_trace = lambda f, c, a: self.timings[-1]["operations"].append((f.f_lasti, c, a))
-        self.timings[-1]["operations"].append((frame.f_lasti, code, arg))
+        time, counts = extra(_calibration_calls, False, False, False)
+        overhead[event_codes[Event.CALL]] = overhead[event_codes[Event.RETURN]] = max(time, 0) / max(counts[event_codes[Event.CALL]] + counts[event_codes[Event.RETURN]], 1)
+
+        # The extra time of the full selection should be what the overheads add up to, within tolerance of the bare time.
+        samples = []
+        for _ in range(repeats):
+            start = perf_counter_ns()
+            _calibration_calls(iterations)
+            samples.append(perf_counter_ns() - start)
+        time, counts = extra(_calibration_calls, backend.lines, backend.opcodes, backend.jumps)
+        if abs(time - sum(count * cost for count, cost in zip(counts, overhead))) > tolerance * median(samples):
+            overhead = [0.0] * len(Event)
+
+        calibrations[key] = overhead
+        return overhead
 
     @cached_property
     def source_lines(self) -> list[str]:
@@ -57,29 +157,70 @@ class Profiler(Callable):
     def source(self) -> str:
         return "".join(self.source_lines)
 
-    def line_operations(self, run_index: int = 0) -> dict[int, list[int]]:
-        line_operations = [operation for operation in self.timings[run_index]["operations"] if operation[1] == "line"]
-        lines_dict = {ins.positions.lineno: [] for ins in self.instructions if ins.positions.lineno is not None}
+    def _fold(self, values: list[int]) -> dict[CodeType, dict[int, int]]:
+        """Sum a value per flat offset into lines, separately for every traced code object."""
+        code_lines = {code: {} for code in self.code_list}
+        for code in self.code_list:
+            for _, _, line_number in code.co_lines():
+                if line_number is not None:
+                    code_lines[code][line_number] = 0
 
-        for operation in line_operations:
-            for instruction in self.instructions:
-                if operation[0] == instruction.offset and instruction.positions.lineno is not None:
-                    lines_dict[instruction.positions.lineno].append(operation[0])
-                    break
+        table = self.line_table
+        code_table = self.code_table
+        for offset, value in enumerate(values):
+            if value and table[offset]:
+                code_lines[self.code_list[code_table[offset]]][table[offset]] += value
 
-        return lines_dict
+        return code_lines
 
-    def operations(self, run_index: int = 0) -> dict[int, list[int]]:
-        operations = [operation for operation in self.timings[run_index]["operations"] if operation[1] == "opcode"]
-        lines_dict = {ins.positions.lineno: [] for ins in self.instructions if ins.positions.lineno is not None}
+    def _lines_of(self, values: list[int]) -> dict[int, int]:
+        """Merge the lines of the function and its nested functions, which share one source file."""
+        code_lines = self._fold(values)
+        lines_dict = {ins.positions.lineno: 0 for ins in self.instructions if ins.positions.lineno is not None}
+        for code in self.function_codes:
+            for line_number, value in code_lines[code].items():
+                lines_dict[line_number] = lines_dict.get(line_number, 0) + value
+        return dict(sorted(lines_dict.items()))
 
-        for operation in operations:
-            for instruction in self.instructions:
-                if operation[0] == instruction.offset and instruction.positions.lineno is not None:
-                    lines_dict[instruction.positions.lineno].append(operation[0])
-                    break
+    def code_operations(self, run_index: int = 0, event: Event = Event.LINE) -> dict[CodeType, dict[int, int]]:
+        """Event counts per line, for every traced code object including callees from other files."""
+        return self._fold(self.timings[run_index]["operations"].offset_counts(event, len(self.line_table)))
+
+    def line_operations(self, run_index: int = 0) -> dict[int, int]:
+        return self._lines_of(self.timings[run_index]["operations"].offset_counts(Event.LINE, len(self.line_table)))
+
+    def operations(self, run_index: int = 0) -> dict[int, int]:
+        """Opcode events per line. Opcode events are only recorded with opcodes = True, and every line is 0 without them."""
+        return self._lines_of(self.timings[run_index]["operations"].offset_counts(Event.OPCODE, len(self.line_table)))
+
+    def offset_times(self, run_index: int = 0) -> list[int]:
+        """Nanoseconds attributed to each flat offset, with the calibrated tracer overhead removed."""
+        return self.timings[run_index]["operations"].offset_times(len(self.line_table), self.timings[run_index]["overhead"])
 
-        return lines_dict
+    def line_times(self, run_index: int = 0) -> dict[int, int]:
+        return self._lines_of(self.offset_times(run_index))
+
+    def call_tree(self, run_index: int = 0) -> CallTree:
+        if "call tree" not in self.timings[run_index]:
+            names = [code.co_qualname for code in self.code_list]
+            self.timings[run_index]["call tree"] = CallTree.build(self.timings[run_index]["operations"], self.code_table, names, self.timings[run_index]["overhead"])
+        return self.timings[run_index]["call tree"]
+
+    def flamegraph(self, path: str, run_index: int = 0) -> None:
+        """Write the collapsed stacks of a run, weighted by time when timestamps were recorded and by event count otherwise."""
+        with open(path, "w") as file:
+            file.write(self.call_tree(run_index).collapsed(self.timings[run_index]["operations"].timestamps))
+            file.write("\n")
+
+    def instruction_times(self, run_index: int = 0) -> dict[int, list[tuple[Instruction, int, int]]]:
+        """Drill down into each line as (instruction, hits, nanoseconds), following the Analyser line to instruction mapping. Hits need opcodes = True."""
+        hits = self.timings[run_index]["operations"].offset_counts(Event.OPCODE, len(self.line_table))
+        times = self.offset_times(run_index)
+
+        return {
+            line_number: [(instruction, hits[instruction.offset], times[instruction.offset]) for instruction in info["instructions"]]
+            for line_number, info in Analyser(self.function).lines.items()
+        }
 
     def overview(self, run_index: int = 0) -> str:
         raw_lines, start = getsourcelines(self.function)
@@ -92,22 +233,40 @@ class Profiler(Callable):
             line_num_padding = max_num_length
 
         line_visit_padding = len("visitations")
-        if (max_num_length := len(str(max(map(len, line_operations.values()))))) > line_visit_padding:
+        if (max_num_length := len(str(max(line_operations.values())))) > line_visit_padding:
             line_visit_padding = max_num_length
 
-        result = f"{max(map(len, self.source_lines)) * '-'}\n"
-        result += "line | visitations | source\n"
-        result += f"{max(map(len, self.source_lines)) * '-'}\n"
+        timed = self.timings[run_index]["operations"].timestamps
+        if timed:
+            line_times = self.line_times(run_index)
+            run_time = sum(line_times.values()) or 1
+
+        header = "line | visitations | "
+        if timed:
+            header += "total (ms) | per hit (µs) | % of run | "
+        header += "source"
+
+        result = f"{max(len(header), max(map(len, self.source_lines))) * '-'}\n"
+        result += f"{header}\n"
+        result += f"{max(len(header), max(map(len, self.source_lines))) * '-'}\n"
 
         for line_num, visitations in line_operations.items():
             for source_line in range(start, start + len(raw_lines)):
                 if source_line == line_num:
                     result += f"{(line_num_padding - len(str(line_num))) * ' '}{line_num}"
-                    result += f" | {(line_visit_padding - len(str(len(visitations)))) * ' '}{len(visitations)}"
+                    result += f" | {(line_visit_padding - len(str(visitations))) * ' '}{visitations}"
+                    if timed:
+                        time = line_times[line_num]
+                        result += f" | {time / 1_000_000:{len("total (ms)")}.3f}"
+                        result += f" | {(time / visitations if visitations else 0) / 1_000:{len("per hit (µs)")}.3f}"
+                        result += f" | {100 * time / run_time:{len("% of run")}.1f}"
                     result += f" | {self.source_lines[line_num - start]}"
                     break
 
+        if timed and not any(self.timings[run_index]["overhead"]):
+            result += "Times include the tracer's own overhead, which was not calibrated or did not agree with a bare run.\n"
+
         return result
 
-def profile(function: Callable) -> Profiler:
-    return Profiler(function)
+def profile(function: Callable, backend: str | Backend = "auto", timestamps: bool = False) -> Profiler:
+    return Profiler(function, backend, timestamps = timestamps)
@@ -0,0 +1,212 @@
+import sys, json, csv, argparse, importlib
+from typing import Callable, Iterable, TextIO
+
+__all__ = "main", "target", "write"
+
+# Only the standard library modules above are imported at startup. Every subcommand imports what it needs when it runs.
+
+def target(name: str) -> Callable:
+    """Resolve module:qualified.name to a function, or the name of an algorithm in sorting_algorithms to its pure-Python function."""
+    if ":" not in name:
+        from sorting_algorithms import algorithms
+        if name not in algorithms:
+            raise KeyError(f"{name} is not module:function or a known algorithm. Choose from {", ".join(algorithms)}.")
+        return algorithms[name]["function"]
+
+    module, _, qualified_name = name.partition(":")
+    value = importlib.import_module(module)
+    for part in qualified_name.split("."):
+        value = getattr(value, part)
+    if not hasattr(value, "__code__"):
+        raise ValueError(f"{name} is a {type(value).__name__}, not a Python function.")
+    return value
+
+# Argument types. argparse turns the ValueError of a bad value into a usage error.
+
+def positive(text: str) -> int:
+    value = int(text)
+    if value < 1:
+        raise ValueError(f"{value} is not a positive integer.")
+    return value
+
+def non_negative(text: str) -> int:
+    value = int(text)
+    if value < 0:
+        raise ValueError(f"{value} is negative.")
+    return value
+
+def seconds(text: str) -> float:
+    value = float(text)
+    if not value > 0:
+        raise ValueError(f"{value} is not a positive number of seconds.")
+    return value
+
+def _input(distribution: str, size: int, seed: int = 0) -> list[int]:
+    from datasets import load
+    dataset = load(distribution, size, seed)
+    data = dataset.copy()
+    dataset.close()
+    return data
+
+def write(records: Iterable[dict], format: str, output: TextIO = sys.stdout) -> None:
+    """Write records as JSON Lines, or as CSV with a header of every key in order of appearance. Lists and dicts become JSON in CSV cells."""
+    if format == "json":
+        output.write("".join(json.dumps(record) + "\n" for record in records))
+        return
+
+    records = list(records)
+    fields = list(dict.fromkeys(key for record in records for key in record))
+    writer = csv.DictWriter(output, fields, lineterminator = "\n")
+    writer.writeheader()
+    for record in records:
+        writer.writerow({key: json.dumps(value) if isinstance(value, (list, dict, tuple)) else value for key, value in record.items()})
+
+def analyse(arguments: argparse.Namespace) -> list[dict]:
+    from analyser import Analyser
+
+    analyser = Analyser(target(arguments.target))
+    specialisation = analyser.warm_up(_input(arguments.distribution, arguments.size), runs = arguments.warm_up) if arguments.warm_up else {}
+
+    records = []
+    for line_number, info in analyser.lines.items():
+        record = {"line": line_number, "code": info["code"], "instructions": [instruction.opname for instruction in info["instructions"]]}
+        if line_number in specialisation:
+            record.update({"adaptive instructions": specialisation[line_number]["instructions"], **{key: specialisation[line_number][key] for key in ("specialised", "unspecialised", "deoptimised")}})
+        records.append(record)
+    return records
+
+def profile(arguments: argparse.Namespace) -> list[dict]:
+    from profiler import Profiler
+
+    profiler = Profiler(target(arguments.target), arguments.backend, timestamps = arguments.timestamps)
+    for seed in range(arguments.runs):
+        profiler(_input(arguments.distribution, arguments.size, seed))
+
+    records = []
+    for run_index in range(len(profiler.timings)):
+        visitations = profiler.line_operations(run_index)
+        times = profiler.line_times(run_index) if arguments.timestamps else {}
+        for line_number, count in visitations.items():
+            record = {"run": run_index, "line": line_number, "visitations": count}
+            if arguments.timestamps:
+                record["time"] = times.get(line_number, 0)
+            records.append(record)
+    return records
+
+def bench(arguments: argparse.Namespace) -> list[dict]:
+    from runner import run
+    from sorting_algorithms import algorithms
+
+    for name in arguments.algorithms or ():
+        if name not in algorithms:
+            raise KeyError(f"{name} is not a known algorithm. Choose from {", ".join(algorithms)}.")
+
+    results = run(arguments.algorithms or tuple(algorithms), arguments.sizes, arguments.distributions, arguments.seeds, arguments.repeats, arguments.workers, arguments.timeout, pin = not arguments.no_pin)
+    if arguments.store:
+        from store import ResultStore
+        store = ResultStore(arguments.store)
+        store.add_results(store.start_run(arguments.label), results)
+        store.close()
+    return results
+
+def fit(arguments: argparse.Namespace) -> list[dict]:
+    from complexity import estimate
+
+    result = estimate(
+        target(arguments.target),
+        lambda size: _input(arguments.distribution, size),
+        start = arguments.start,
+        max_size = arguments.max_size,
+        repeats = arguments.repeats,
+        metric = arguments.metric,
+        budget = arguments.budget
+    )
+    return [
+        {
+            "model": candidate.model,
+            "readable": candidate.readable,
+            "constant": candidate.constant,
+            "low": candidate.interval[0],
+            "high": candidate.interval[1],
+            "error": candidate.error,
+            "best": candidate is result.best,
+            "metric": result.metric,
+            "sizes": result.sizes,
+            "measurements": result.measurements
+        }
+        for candidate in result.fits
+    ]
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog = "python -m pyrftester", description = "Analyse, profile and benchmark Python functions. Functions are given as module:function or as an algorithm name.")
+    parser.add_argument("--format", choices = ("json", "csv"), default = "json", help = "JSON Lines or CSV output (default: json)")
+    parser.add_argument("--output", "-o", help = "write to this file instead of stdout")
+
+    # The output options are also accepted after the subcommand. Their defaults are suppressed there so they do not overwrite a value given before it.
+    output = argparse.ArgumentParser(add_help = False)
+    output.add_argument("--format", choices = ("json", "csv"), default = argparse.SUPPRESS, help = "JSON Lines or CSV output (default: json)")
+    output.add_argument("--output", "-o", default = argparse.SUPPRESS, help = "write to this file instead of stdout")
+    subcommands = parser.add_subparsers(dest = "command", required = True)
+
+    def dataset(subcommand: argparse.ArgumentParser, size: int) -> None:
+        subcommand.add_argument("--distribution", default = "uniform", help = "input distribution from datasets (default: uniform)")
+        subcommand.add_argument("--size", type = positive, default = size, help = f"input size (default: {size})")
+
+    subcommand = subcommands.add_parser("analyse", parents = [output], help = "bytecode instructions per source line")
+    subcommand.add_argument("target")
+    subcommand.add_argument("--warm-up", type = non_negative, default = 0, metavar = "RUNS", help = "run the function this many times first and report its specialised instructions")
+    dataset(subcommand, 1_000)
+    subcommand.set_defaults(handler = analyse)
+
+    subcommand = subcommands.add_parser("profile", parents = [output], help = "line visitations, and times with --timestamps")
+    subcommand.add_argument("target")
+    subcommand.add_argument("--backend", default = "auto", help = "tracing backend: auto, monitoring or settrace (default: auto)")
+    subcommand.add_argument("--runs", type = positive, default = 1, help = "number of runs, each on a different seed (default: 1)")
+    subcommand.add_argument("--timestamps", action = "store_true", help = "record event times and report time per line")
+    dataset(subcommand, 1_000)
+    subcommand.set_defaults(handler = profile)
+
+    subcommand = subcommands.add_parser("bench", parents = [output], help = "time algorithms over sizes and distributions on a process pool")
+    subcommand.add_argument("--algorithms", nargs = "+", default = None, help = "algorithm names (default: all)")
+    subcommand.add_argument("--sizes", nargs = "+", type = positive, default = [1_000, 10_000])
+    subcommand.add_argument("--distributions", nargs = "+", default = ["uniform"])
+    subcommand.add_argument("--seeds", nargs = "+", type = non_negative, default = [0])
+    subcommand.add_argument("--repeats", type = positive, default = 3)
+    subcommand.add_argument("--workers", type = positive, default = None, help = "worker processes (default: one per core)")
+    subcommand.add_argument("--timeout", type = seconds, default = 60, help = "seconds before a job is abandoned (default: 60)")
+    subcommand.add_argument("--no-pin", action = "store_true", help = "do not pin workers to cores")
+    subcommand.add_argument("--store", help = "also log the samples as a new run in this results database")
+    subcommand.add_argument("--label", default = "", help = "label of the run in the results database")
+    subcommand.set_defaults(handler = bench)
+
+    subcommand = subcommands.add_parser("fit", parents = [output], help = "estimate time complexity by fitting models over growing sizes")
+    subcommand.add_argument("target")
+    subcommand.add_argument("--metric", choices = ("time", "operations"), default = "time")
+    subcommand.add_argument("--distribution", default = "uniform", help = "input distribution from datasets (default: uniform)")
+    subcommand.add_argument("--start", type = positive, default = 64)
+    subcommand.add_argument("--max-size", type = positive, default = 1 << 20)
+    subcommand.add_argument("--repeats", type = positive, default = 5)
+    subcommand.add_argument("--budget", type = seconds, default = 60, help = "seconds to spend growing the size (default: 60)")
+    subcommand.set_defaults(handler = fit)
+
+    return parser
+
+def main(argv: list[str] | None = None) -> int:
+    arguments = _parser().parse_args(argv)
+    # OSError covers targets without a source file and unwritable outputs, ArithmeticError measurements a fit cannot use.
+    try:
+        records = arguments.handler(arguments)
+        file = open(arguments.output, "w", newline = "") if arguments.output else None
+    except (KeyError, ValueError, RuntimeError, ImportError, AttributeError, OSError, ArithmeticError) as error:
+        print(f"{type(error).__name__}: {error.args[0] if isinstance(error, KeyError) and error.args else error}", file = sys.stderr)
+        return 2
+
+    if file is None:
+        write(records, arguments.format)
+    else:
+        with file:
+            write(records, arguments.format, file)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,152 @@
+import os, gc, signal
+from typing import Iterable, NamedTuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Value
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter_ns
+
+from sorting_algorithms import algorithms
+from datasets import load
+
+__all__ = "Job", "run", "to_evaluator"
+
+class Job(NamedTuple):
+    algorithm: str
+    distribution: str
+    size: int
+    seed: int
+    repeat: int
+
+def _attach(name: str) -> SharedMemory:
+    # Workers only read the block, so keep the resource tracker from unlinking it when they exit (Python 3.13+).
+    try:
+        return SharedMemory(name = name, track = False)
+    except TypeError:
+        return SharedMemory(name = name)
+
+def _timed_out(signum, frame):
+    raise TimeoutError
+
+def _initialise(counter, pin: bool) -> None:
+    # Give every worker its own core, so jobs do not migrate between cores mid-run.
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if pin and hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cores[index % len(cores)]})
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _timed_out)
+
+def _run_job(job: Job, name: str, timeout: float) -> dict:
+    memory = _attach(name)
+    try:
+        view = memory.buf[:job.size * 8].cast("q")
+        iterable = view.tolist()
+        view.release()
+    finally:
+        memory.close()
+
+    function = algorithms[job.algorithm]["function"]
+    result = {**job._asdict(), "time": None, "valid": False, "timed out": False}
+
+    # Keep collector pauses out of the timed region.
+    gc.collect()
+    gc.disable()
+
+    if hasattr(signal, "setitimer"):
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        start = perf_counter_ns()
+        function(iterable)
+        end = perf_counter_ns()
+    except TimeoutError:
+        result["timed out"] = True
+        return result
+    finally:
+        if hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        gc.enable()
+
+    result["time"] = end - start
+    result["valid"] = all(iterable[i] <= iterable[i + 1] for i in range(len(iterable) - 1))
+    return result
+
+def run(
+        names: Iterable[str] = tuple(algorithms),
+        sizes: Iterable[int] = (1_000, 10_000),
+        distributions: Iterable[str] = ("uniform",),
+        seeds: Iterable[int] = (0,),
+        repeats: int = 3,
+        workers: int | None = None,
+        timeout: float = 60,
+        pin: bool = True) -> list[dict]:
+    """
+    Run every (algorithm, distribution, size, seed, repeat) job on a process pool and collect one result dict per job.
+    Each input array is loaded once from the dataset cache and shared with the workers through shared memory instead of being pickled per job.
+    Jobs running longer than timeout seconds are interrupted and reported as timed out.
+    """
+    names, sizes, distributions, seeds = list(names), list(sizes), list(distributions), list(seeds)
+
+    inputs: dict[tuple[str, int, int], SharedMemory] = {}
+    try:
+        for distribution in distributions:
+            for size in sizes:
+                for seed in seeds:
+                    dataset = load(distribution, size, seed)
+                    memory = SharedMemory(create = True, size = max(size * 8, 1))
+                    memory.buf[:size * 8] = dataset.tobytes()
+                    dataset.close()
+                    inputs[(distribution, size, seed)] = memory
+
+        jobs = [
+            Job(name, distribution, size, seed, repeat)
+            for name in names for distribution in distributions for size in sizes for seed in seeds for repeat in range(repeats)
+        ]
+        results = []
+        with ProcessPoolExecutor(max_workers = workers, initializer = _initialise, initargs = (Value("i", 0), pin)) as executor:
+            futures = [executor.submit(_run_job, job, inputs[(job.distribution, job.size, job.seed)].name, timeout) for job in jobs]
+            for future in as_completed(futures):
+                results.append(future.result())
+    finally:
+        for memory in inputs.values():
+            memory.close()
+            memory.unlink()
+
+    return sorted(results, key = lambda result: (result["algorithm"], result["distribution"], result["size"], result["seed"], result["repeat"]))
+
+def to_evaluator(results: list[dict]):
+    """Group job results per algorithm, distribution and size into an Evaluator, so Evaluator.format can render their time distribution by name, e.g. "merge uniform n=1000"."""
+    from evaluator import Evaluator
+
+    evaluator = Evaluator("none")
+    groups: dict[tuple[str, str, int], list[dict]] = {}
+    for result in results:
+        groups.setdefault((result["algorithm"], result["distribution"], result["size"]), []).append(result)
+
+    for (name, distribution, size), group in groups.items():
+        function = algorithms[name]["function"]
+        times = [result["time"] for result in group if result["time"] is not None]
+        evaluator.results[(name, distribution, size)] = {
+            "file": function.__code__.co_filename,
+            "name": f"{name} {distribution} n={size}",
+            "line": function.__code__.co_firstlineno,
+            "function": function,
+            "calls": len(group),
+            "helper calls": 0,
+            "comparisons": 0,
+            "memory access": 0,
+            "memory mutations": 0,
+            "memory usage": [],
+            "other": 0,
+            "time": times,
+            "valid": all(result["valid"] for result in group)
+        }
+
+    return evaluator
+
+if __name__ == "__main__":
+
+    evaluator = to_evaluator(run())
+    for result in evaluator.results.values():
+        print(evaluator.format(result["name"]))
@@ -0,0 +1,157 @@
+import sys
+from typing import Callable, Iterable, Any
+from types import CodeType
+from time import perf_counter
+from threading import Thread, Event, get_ident
+from collections import Counter
+from inspect import getsourcelines
+from functools import cached_property
+from math import sqrt
+
+from analyser import code_objects, flat_tables
+
+__all__ = "Sampler", "sample"
+
+class Sampler(Callable):
+    """
+    Statistical profiler for targets too slow to trace deterministically.
+    A background thread snapshots the calling thread's stack through sys._current_frames at a fixed rate,
+    and charges each sample to the innermost frame that runs the function, one of its nested functions or a given callee.
+    The sampler thread can only run when the target releases the GIL, which it does at backward jumps and calls,
+    so within a loop the samples lean towards the line that closes the loop body. Shares between functions are unaffected.
+    """
+
+    def __init__(self, function: Callable, rate: float = 1000, callees: Iterable[Callable] = ()) -> None:
+        self.function = function
+        self.rate = rate
+        self.timings: list[dict] = []
+
+        self.function_codes: list[CodeType] = code_objects(function.__code__)
+        self.code_list: list[CodeType] = list(dict.fromkeys(self.function_codes + [code for callee in callees for code in code_objects(callee.__code__)]))
+        self.bases, self.line_table, self.code_table = flat_tables(self.code_list)
+
+    def __call__(self, *args, **kwargs) -> Any:
+
+        samples = Counter()
+        self.timings.append({"samples": samples, "missed": 0})
+
+        stop = Event()
+        sampler = Thread(target = self._sample, args = (get_ident(), samples, stop), daemon = True)
+
+        # The GIL is handed over at most once per switch interval, which would otherwise cap the sampling rate.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, 1 / self.rate))
+
+        start = perf_counter()
+        sampler.start()
+        try:
+            result = self.function(*args, **kwargs)
+        finally:
+            stop.set()
+            end = perf_counter()
+            sampler.join()
+            sys.setswitchinterval(switch_interval)
+
+        self.timings[-1]["time"] = end - start
+
+        return result
+
+    def _sample(self, thread_id: int, samples: Counter, stop: Event) -> None:
+        interval = 1 / self.rate
+        current_frames = sys._current_frames
+        bases = self.bases
+        missed = 0
+
+        while not stop.wait(interval):
+            frame = current_frames().get(thread_id)
+            while frame is not None:
+                base = bases.get(id(frame.f_code))
+                if base is not None:
+                    samples[base + frame.f_lasti] += 1
+                    break
+                frame = frame.f_back
+            else:
+                missed += 1
+
+        self.timings[-1]["missed"] = missed
+
+    @cached_property
+    def source_lines(self) -> list[str]:
+        lines = getsourcelines(self.function)[0]
+        spaces = len(lines[0]) - len(lines[0].strip(" "))
+        return [line[spaces:] for line in lines]
+
+    def line_samples(self, run_index: int = 0) -> dict[int, int]:
+        """Samples per line of the function and its nested functions."""
+        lines_dict = {}
+        for code in self.function_codes:
+            for _, _, line_number in code.co_lines():
+                if line_number is not None:
+                    lines_dict[line_number] = 0
+
+        function_indices = set(range(len(self.function_codes)))
+        for offset, count in self.timings[run_index]["samples"].items():
+            line_number = self.line_table[offset]
+            if line_number and self.code_table[offset] in function_indices:
+                lines_dict[line_number] += count
+
+        return dict(sorted(lines_dict.items()))
+
+    def function_samples(self, run_index: int = 0) -> dict[str, int]:
+        """Samples per traced code object, keyed by qualified name: the function, its nested functions and the callees."""
+        counts = [0] * len(self.code_list)
+        for offset, count in self.timings[run_index]["samples"].items():
+            counts[self.code_table[offset]] += count
+        return {code.co_qualname: count for code, count in zip(self.code_list, counts)}
+
+    def estimates(self, run_index: int = 0, z: float = 1.96) -> dict[str, tuple[float, float]]:
+        """
+        Estimated share of the run per function with the half width of its confidence interval, from the normal approximation of the binomial.
+        There are no intervals per line: samples only land where the GIL is handed over, so line shares are biased in a way no interval shows.
+        """
+        function_samples = self.function_samples(run_index)
+        total = sum(self.timings[run_index]["samples"].values())
+        if total == 0:
+            return {name: (0.0, 0.0) for name in function_samples}
+
+        return {
+            name: (count / total, z * sqrt(count / total * (1 - count / total) / total))
+            for name, count in function_samples.items()
+        }
+
+    def overview(self, run_index: int = 0) -> str:
+        raw_lines, start = getsourcelines(self.function)
+        line_samples = self.line_samples(run_index)
+        total = sum(self.timings[run_index]["samples"].values()) or 1
+
+        line_num_padding = max(len("line"), len(str(max(line_samples.keys()))))
+        sample_padding = max(len("samples"), len(str(max(line_samples.values()))))
+
+        header = "line | samples | % of run | source"
+        result = f"{max(len(header), max(map(len, self.source_lines))) * '-'}\n"
+        result += f"{header}\n"
+        result += f"{max(len(header), max(map(len, self.source_lines))) * '-'}\n"
+
+        for line_num, count in line_samples.items():
+            if start <= line_num < start + len(raw_lines):
+                result += f"{line_num:{line_num_padding}}"
+                result += f" | {count:{sample_padding}}"
+                result += f" | {100 * count / total:{len("% of run")}.1f}"
+                result += f" | {self.source_lines[line_num - start]}"
+
+        result += "Samples only land where the GIL is handed over, at backward jumps and calls, so line shares lean towards the lines that close loops and make calls.\n"
+        result += "Per function, where the hand-off points no longer decide which line a sample is put on:\n"
+        estimates = self.estimates(run_index)
+        name_padding = max(len("function"), *map(len, estimates))
+        result += f"{"function":{name_padding}} | % of run | ± 95%\n"
+        for name, (share, error) in estimates.items():
+            result += f"{name:{name_padding}} | {100 * share:{len("% of run")}.1f} | {100 * error:5.1f}\n"
+
+        timing = self.timings[run_index]
+        samples = sum(timing["samples"].values())
+        result += f"{samples} samples, {timing["missed"]} outside the function, {(samples + timing["missed"]) / timing["time"]:.0f} samples per second\n"
+
+        return result
+
+def sample(function: Callable, rate: float = 1000) -> Sampler:
+    return Sampler(function, rate)
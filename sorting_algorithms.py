@@ -1,7 +1,12 @@
 from random import randint
-from time import perf_counter_ns
 from typing import MutableSequence
 from math import log2
+from array import array as typed_array
+
+try:
+    import numpy_sorting
+except ImportError:
+    numpy_sorting = None
 
 def bubble_sort(array: MutableSequence) -> MutableSequence:
     length = len(array) - 1
@@ -70,6 +75,90 @@ def radix_sort(array: MutableSequence[int]) -> None:
                 j += 1
             digit_arrays[k].clear()
 
+# Runs up to this length are sorted by insertion before the bottom-up merge passes start.
+RUN = 32
+
+def merge_sort_buffered(array: MutableSequence[int]) -> None:
+    """Bottom-up merge sort that merges back and forth between the array and one auxiliary buffer instead of slicing at every level."""
+    length = len(array)
+
+    for start in range(0, length, RUN):
+        end = min(start + RUN, length)
+        for i in range(start + 1, end):
+            value = array[i]
+            j = i - 1
+            while j >= start and array[j] > value:
+                array[j + 1] = array[j]
+                j -= 1
+            array[j + 1] = value
+
+    # Start from whichever side makes the last pass write into the array, so the result never has to be copied back.
+    passes = 0
+    while RUN << passes < length:
+        passes += 1
+    source, target = (list(array), array) if passes % 2 else (array, [0] * length)
+
+    width = RUN
+    while width < length:
+        for start in range(0, length, 2 * width):
+            middle, end = min(start + width, length), min(start + 2 * width, length)
+            i, j = start, middle
+            for k in range(start, end):
+                if j >= end or (i < middle and source[i] <= source[j]):
+                    target[k] = source[i]
+                    i += 1
+                else:
+                    target[k] = source[j]
+                    j += 1
+        source, target = target, source
+        width *= 2
+
+def radix_sort_bytes(array: MutableSequence[int]) -> None:
+    """
+    LSD radix sort in base 256 on the offsets of the values from the minimum. It sorts element indices, held in at most two array('I') buffers, rather than the values.
+    Each pass counts the digits, turns the counts into prefix offsets and scatters the indices into the other buffer. Passes where every key has the same digit are skipped.
+    The sorted order is then applied in place by following its cycles, so the original int objects are moved rather than new ones created.
+    """
+    length = len(array)
+    if length < 2:
+        return
+
+    minimum = min(array)
+    passes = ((max(array) - minimum).bit_length() + 7) // 8
+    # Until the first pass that is not skipped, the order is the identity. The second buffer is only made when that pass needs it.
+    typecode = "I" if length < 1 << 32 else "Q"
+    order = range(length)
+    buffer = typed_array(typecode, [0]) * length
+
+    for shift in range(0, 8 * passes, 8):
+        offsets = [0] * 257
+        for value in array:
+            offsets[(((value - minimum) >> shift) & 0xFF) + 1] += 1
+        if max(offsets) == length:
+            continue
+        for digit in range(256):
+            offsets[digit + 1] += offsets[digit]
+
+        for index in order:
+            digit = ((array[index] - minimum) >> shift) & 0xFF
+            buffer[offsets[digit]] = index
+            offsets[digit] += 1
+        order, buffer = buffer, order if type(order) is not range else typed_array(typecode, [0]) * length
+
+    # Position i takes the element at order[i]. Every finished position is marked by setting order[i] to i.
+    for start in range(length):
+        if order[start] == start:
+            continue
+        value = array[start]
+        i = start
+        while order[i] != start:
+            source = order[i]
+            array[i] = array[source]
+            order[i] = i
+            i = source
+        array[i] = value
+        order[i] = i
+
 def quick_sort(array: MutableSequence[int]) -> None:
 
     def find_partition(array: MutableSequence[int], left: int, right: int):
@@ -108,16 +197,31 @@ algorithms = {
     "insertion": {"function": insertion_sort, "complexity": lambda w, n: n**2, "readable": "n²"},
     "quick": {"function": quick_sort, "complexity": lambda w, n: n * log2(n), "readable": "n * log n"},
     "merge": {"function": merge_sort, "complexity": lambda w, n: n * log2(n), "readable": "n * log n"},
-    "radix": {"function": radix_sort, "complexity": lambda w, n: w * n, "readable": "w * n"}
+    "radix": {"function": radix_sort, "complexity": lambda w, n: w * n, "readable": "w * n"},
+    "merge_buffered": {"function": merge_sort_buffered, "complexity": lambda w, n: n * log2(n), "readable": "n * log n"},
+    "radix_bytes": {"function": radix_sort_bytes, "complexity": lambda w, n: w * n, "readable": "w * n"}
 }
 
+# Alternative implementations of every algorithm by backend. The NumPy backend is only present when NumPy is installed and has a version of the sort.
+for name, algorithm in algorithms.items():
+    algorithm["backends"] = {"python": algorithm["function"]}
+    if numpy_sorting is not None and hasattr(numpy_sorting, algorithm["function"].__name__):
+        algorithm["backends"]["numpy"] = getattr(numpy_sorting, algorithm["function"].__name__)
+
+def sort_function(name: str, backend: str = "python"):
+    """The implementation of an algorithm in the registry for the given backend."""
+    backends = algorithms[name]["backends"]
+    if backend not in backends:
+        raise ValueError(f"{name} sort has no {backend} backend. Choose from {", ".join(backends)}.")
+    return backends[backend]
+
 if __name__ == "__main__":
 
     print("---------- Sorting algorithm testing ----------")
 
     # Get valid array length input
     length = input("Length of the array to sort: ")
-    while not length.isdigit():
+    while not length.isdigit() or int(length) == 0:
         length = input("Choose a positive integer length for the array: ")
     length = int(length)
 
@@ -129,24 +233,32 @@ if __name__ == "__main__":
         algorithm = input("Choose an algorithm from the list: ").lower()
 
     # Get valid option for viewing
-    print("\nOptions:\n1 - Time algorithm\n2 - Estimate time complexity constant")
+    print("\nOptions:\n1 - Time algorithm\n2 - Estimate time complexity constant\n3 - Fit time complexity up to the array length")
     option = input("Choose an option: ")
-    while option not in ("1", "2"):
-        option = input("Choose a number 1 or 2: ")
+    while option not in ("1", "2", "3"):
+        option = input("Choose a number 1, 2 or 3: ")
+
+    if option == "3":
+        if length < 2:
+            raise SystemExit("Fitting needs an array length of at least 2 to measure two sizes.")
+        from complexity import estimate
+        print()
+        print(estimate(algorithms[algorithm]["function"], start = min(64, length - 1), max_size = length))
+        raise SystemExit
 
     # Create array of random numbers
     array_to_sort = [randint(0, 2 * length) for _ in range(length)]
 
-    # Sort the array using the correct function and time the execution
-    start = perf_counter_ns()
-    algorithms[algorithm]["function"](array_to_sort)
-    end = perf_counter_ns()
+    # Sort copies of the array using the correct function and take the median time of the repeats
+    from timing import time_function
+    timing = time_function(algorithms[algorithm]["function"], array_to_sort)
 
-    timed = (end - start)
+    timed = timing.median
 
     # Display with the chosen option
     if option == "1":
         print(f"\n{algorithm} sort took {round(timed / 1_000_000, 4)}ms to finish with an array of length {length}.")
+        print(timing)
     elif option == "2":
         num_length = len(str(max(array_to_sort)))
         print(f"\nThe approximate time per operation for {algorithm} sort:")
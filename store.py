@@ -0,0 +1,204 @@
+import os, sys, time, json, sqlite3, hashlib, platform
+from typing import Callable, Iterable
+from statistics import median
+
+from analyser import code_digest
+from timing import rank_sum
+
+__all__ = "fingerprint", "environment", "ResultStore"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    label TEXT NOT NULL,
+    started REAL NOT NULL,
+    environment TEXT NOT NULL,
+    python TEXT NOT NULL,
+    cpu TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    function TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    time INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_key ON samples (function, dataset, size, run);
+CREATE INDEX IF NOT EXISTS samples_run ON samples (run);
+"""
+
+def fingerprint(function: Callable) -> str:
+    """
+    A name for a function that is the same in every process: its module and qualified name, and a digest of its bytecode, names and constants and those of its nested functions.
+    Editing the function gives a new fingerprint, even if only a literal or a name changed. Moving it around in its file does not.
+    """
+    return f"{function.__module__}.{function.__qualname__}:{code_digest(function.__code__, digest_size = 8)}"
+
+def _cpu() -> str:
+    try:
+        with open("/proc/cpuinfo") as file:
+            for line in file:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+def environment() -> dict[str, str]:
+    """The interpreter and machine results were measured on. Runs are only comparable when their environment IDs match."""
+    info = {
+        "python": f"{platform.python_implementation()} {platform.python_version()}",
+        "build": "free-threaded" if not getattr(sys, "_is_gil_enabled", lambda: True)() else "gil",
+        "cpu": _cpu(),
+        "cores": str(os.cpu_count()),
+        "system": f"{platform.system()} {platform.machine()}"
+    }
+    info["id"] = hashlib.blake2b(json.dumps(info, sort_keys = True).encode(), digest_size = 8).hexdigest()
+    return info
+
+class ResultStore(object):
+    """
+    Timing samples of many runs in one SQLite file, keyed by function fingerprint, dataset, size and run.
+    Samples are buffered and written in batches, so logging costs little during large sweeps.
+    """
+
+    def __init__(self, path: str, batch: int = 10_000) -> None:
+        self.path = path
+        self.batch = batch
+        self.pending: list[tuple[int, str, str, int, int]] = []
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def start_run(self, label: str = "") -> int:
+        """Register a new run in the current environment and return its ID."""
+        info = environment()
+        cursor = self.connection.execute(
+            "INSERT INTO runs (label, started, environment, python, cpu) VALUES (?, ?, ?, ?, ?)",
+            (label, time.time(), info["id"], info["python"], info["cpu"])
+        )
+        self.connection.commit()
+        return cursor.lastrowid
+
+    def add(self, run: int, function: Callable | str, dataset: str, size: int, times: Iterable[int]) -> None:
+        """Queue timing samples in nanoseconds of a function, given as a callable or a fingerprint."""
+        key = function if isinstance(function, str) else fingerprint(function)
+        self.pending.extend((run, key, dataset, size, int(sample)) for sample in times)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def add_results(self, run: int, results: Iterable[dict]) -> None:
+        """Queue the job results of runner.run, with the dataset ID made of the distribution and seed."""
+        from sorting_algorithms import algorithms
+
+        fingerprints = {}
+        for result in results:
+            if result["time"] is None:
+                continue
+            name = result["algorithm"]
+            if name not in fingerprints:
+                fingerprints[name] = fingerprint(algorithms[name]["function"])
+            self.add(run, fingerprints[name], f"{result["distribution"]} seed={result["seed"]}", result["size"], (result["time"],))
+
+    def add_evaluator(self, run: int, evaluator, dataset: str, size: int) -> None:
+        """Queue the time samples of every function an Evaluator measured on one dataset and size."""
+        for result in evaluator.results.values():
+            self.add(run, result["function"], dataset, size, result["time"])
+
+    def flush(self) -> None:
+        if self.pending:
+            self.connection.executemany("INSERT INTO samples (run, function, dataset, size, time) VALUES (?, ?, ?, ?, ?)", self.pending)
+            self.connection.commit()
+            self.pending.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+    def runs(self) -> list[dict]:
+        self.flush()
+        cursor = self.connection.execute("SELECT id, label, started, environment, python, cpu FROM runs ORDER BY id")
+        return [dict(zip(("id", "label", "started", "environment", "python", "cpu"), row)) for row in cursor]
+
+    def samples(self, run: int, function: str | None = None, dataset: str | None = None, size: int | None = None) -> dict[tuple[str, str, int], list[int]]:
+        """Samples of a run grouped by (function, dataset, size), optionally narrowed down to one function, dataset or size."""
+        self.flush()
+        query = "SELECT function, dataset, size, time FROM samples WHERE run = ?"
+        parameters: list = [run]
+        for column, value in (("function", function), ("dataset", dataset), ("size", size)):
+            if value is not None:
+                query += f" AND {column} = ?"
+                parameters.append(value)
+
+        grouped: dict[tuple[str, str, int], list[int]] = {}
+        for function, dataset, size, sample in self.connection.execute(query, parameters):
+            grouped.setdefault((function, dataset, size), []).append(sample)
+        return grouped
+
+    @staticmethod
+    def _by_name(samples: dict[tuple[str, str, int], list[int]]) -> dict[tuple[str, str, int], tuple[str, list[int]]]:
+        # Drop the code digest from the fingerprint, so a function is still matched after its code changed.
+        return {(function.rpartition(":")[0], dataset, size): (function, times) for (function, dataset, size), times in samples.items()}
+
+    def compare(self, base: int, head: int, alpha: float = 0.01, threshold: float = 0.02) -> list[dict]:
+        """
+        Compare every function, dataset and size measured in both runs. Functions are matched by name, and code changed tells whether their bytecode differs.
+        A change is significant when a Mann-Whitney U test rejects equal distributions at alpha and the medians differ by more than threshold.
+        """
+        environments = {run["id"]: run["environment"] for run in self.runs()}
+        for run in (base, head):
+            if run not in environments:
+                raise KeyError(f"Run {run} is not in {self.path}.")
+
+        before, after = self._by_name(self.samples(base)), self._by_name(self.samples(head))
+        comparisons = []
+        for key in sorted(before.keys() & after.keys()):
+            (old_fingerprint, old_times), (new_fingerprint, new_times) = before[key], after[key]
+            old, new = median(old_times), median(new_times)
+            p = rank_sum(old_times, new_times)
+            ratio = new / old if old else float("inf")
+            significant = p < alpha and abs(ratio - 1) > threshold
+            comparisons.append({
+                "function": key[0],
+                "dataset": key[1],
+                "size": key[2],
+                "base": old,
+                "head": new,
+                "ratio": ratio,
+                "p": p,
+                "regression": significant and ratio > 1,
+                "improvement": significant and ratio < 1,
+                "code changed": old_fingerprint != new_fingerprint,
+                "same environment": environments[base] == environments[head]
+            })
+        return comparisons
+
+    def format_comparison(self, comparisons: list[dict]) -> str:
+        result = f"{"function":40} | {"dataset":16} | {"size":>8} | {"base (ms)":>10} | {"head (ms)":>10} | {"ratio":>6} | {"p":>8} | {"code":7} | verdict\n"
+        for comparison in comparisons:
+            verdict = "REGRESSION" if comparison["regression"] else "improved" if comparison["improvement"] else ""
+            result += (
+                f"{comparison["function"]:40} | {comparison["dataset"]:16} | {comparison["size"]:8} | "
+                f"{comparison["base"] / 1_000_000:10.3f} | {comparison["head"] / 1_000_000:10.3f} | "
+                f"{comparison["ratio"]:5.2f}x | {comparison["p"]:8.2g} | {"changed" if comparison["code changed"] else "same":7} | {verdict}\n"
+            )
+        if comparisons and not all(comparison["same environment"] for comparison in comparisons):
+            result += "Warning: the runs were measured in different environments.\n"
+        return result
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ("runs", "compare") or (sys.argv[1] == "compare" and len(sys.argv) < 5):
+        raise SystemExit("Usage: python store.py runs <database>\n       python store.py compare <database> <base run> <head run>")
+
+    store = ResultStore(sys.argv[2])
+    if sys.argv[1] == "runs":
+        for run in store.runs():
+            print(f"{run["id"]:4} | {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started"]))} | {run["python"]} | {run["cpu"]} | {run["label"]}")
+    else:
+        comparisons = store.compare(int(sys.argv[3]), int(sys.argv[4]))
+        print(store.format_comparison(comparisons), end = "")
+        store.close()
+        raise SystemExit(1 if any(comparison["regression"] for comparison in comparisons) else 0)
+    store.close()
@@ -0,0 +1,229 @@
+import json, struct, gzip, hashlib, threading
+from array import array
+from queue import Queue
+from types import CodeType
+from typing import Iterator
+
+from analyser import code_digest
+from events import EventBuffer, Chunk, event_codes
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+__all__ = "TraceWriter", "TraceReader", "codes_digest"
+
+MAGIC = b"PYRFTRC1"
+
+# Every frame starts with its event count and compressed length. The trace ends with an empty frame holding the run time as a double.
+FRAME = struct.Struct("<II")
+END = struct.Struct("<d")
+
+def _codec() -> str:
+    if zstandard is not None:
+        return "zstd"
+    if lz4 is not None:
+        return "lz4"
+    return "gzip"
+
+def _compressor(codec: str):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level = 1).compress
+    if codec == "lz4":
+        return lz4.frame.compress
+    return lambda data: gzip.compress(data, compresslevel = 1)
+
+def _decompressor(codec: str):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The trace is compressed with zstd, but the zstandard package is not installed.")
+        return zstandard.ZstdDecompressor().decompress
+    if codec == "lz4":
+        if lz4 is None:
+            raise RuntimeError("The trace is compressed with lz4, but the lz4 package is not installed.")
+        return lz4.frame.decompress
+    return gzip.decompress
+
+def codes_digest(codes: list[CodeType]) -> str:
+    """Digest of the traced code objects, their names and constants included, in flat table order. A trace can only be replayed against the same code."""
+    digest = hashlib.blake2b(digest_size = 16)
+    for code in codes:
+        digest.update(code.co_qualname.encode())
+        digest.update(code_digest(code).encode())
+    return digest.hexdigest()
+
+class TraceWriter(object):
+    """
+    Write traced events to a compressed file while the traced function runs.
+    It has the columns, chunk_size and append of an EventBuffer, so tracing backends fill it the same way, one frame of chunk_size events at a time.
+    Full frames go through a bounded queue to a writer thread, which compresses and writes them, so memory use stays at a few frames however long the run is.
+    When the queue is full the traced thread waits for the writer.
+    """
+    __slots__ = (
+        "path",
+        "timestamps",
+        "chunk_size",
+        "offsets",
+        "events",
+        "times",
+        "queue",
+        "thread",
+        "error",
+        "stored"
+    )
+
+    def __init__(self, path: str, codes: list[CodeType], timestamps: bool = False, chunk_size: int = 1 << 16, frames: int = 8, codec: str | None = None, overhead: list[float] | None = None) -> None:
+        self.path = path
+        self.timestamps = timestamps
+        self.chunk_size = chunk_size
+        self.offsets = array("I")
+        self.events = array("B")
+        self.times = array("Q") if timestamps else None
+        self.queue: Queue = Queue(maxsize = frames)
+        self.error: BaseException | None = None
+        self.stored = 0
+
+        codec = codec or _codec()
+        # The calibrated tracer overhead per event type is stored with the trace, so replayed times are corrected like live ones.
+        header = json.dumps({"codec": codec, "timestamps": timestamps, "overhead": overhead or [0.0] * len(event_codes), "codes": codes_digest(codes), "names": [code.co_qualname for code in codes]}).encode()
+        file = open(path, "wb")
+        file.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+        self.thread = threading.Thread(target = self._drain, args = (file, _compressor(codec)), name = "pyrftester trace writer", daemon = True)
+        self.thread.start()
+
+    def _drain(self, file, compress) -> None:
+        try:
+            while True:
+                frame = self.queue.get()
+                if frame is None:
+                    break
+                if isinstance(frame, float):
+                    file.write(FRAME.pack(0, END.size) + END.pack(frame))
+                    continue
+                offsets, events, times = frame
+                payload = compress(offsets.tobytes() + events.tobytes() + (times.tobytes() if times is not None else b""))
+                file.write(FRAME.pack(len(offsets), len(payload)) + payload)
+        except BaseException as error:
+            self.error = error
+            # Keep taking frames, so the traced thread is never left waiting on a full queue.
+            while self.queue.get() is not None:
+                pass
+        finally:
+            file.close()
+
+    def append(self, offset: int, event: int, timestamp: int = 0) -> None:
+        self.offsets.append(offset)
+        self.events.append(event)
+        if self.times is not None:
+            self.times.append(timestamp)
+        if len(self.offsets) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Hand the current frame to the writer thread."""
+        if not self.offsets:
+            return
+        self.stored += len(self.offsets)
+        # Copied out and emptied like EventBuffer.flush does, since tracing hooks hold on to the columns.
+        self.queue.put((self.offsets[:], self.events[:], self.times[:] if self.times is not None else None))
+        del self.offsets[:], self.events[:]
+        if self.times is not None:
+            del self.times[:]
+
+    def __len__(self) -> int:
+        return self.stored + len(self.offsets)
+
+    def close(self, time: float = 0.0) -> None:
+        """Write the last frame and the run time, and wait until everything is on disk."""
+        self.flush()
+        self.queue.put(float(time))
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"Writing the trace to {self.path} failed.") from self.error
+
+class TraceReader(EventBuffer):
+    """
+    A saved trace with the analysis methods of EventBuffer.
+    Frames are read and decompressed one at a time on every pass, so even traces larger than memory are analysed in constant memory.
+    """
+    __slots__ = (
+        "path",
+        "codec",
+        "codes",
+        "names",
+        "start",
+        "time",
+        "overhead",
+        "length"
+    )
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a trace file.")
+            size, = struct.unpack("<I", file.read(4))
+            header = json.loads(file.read(size))
+            start = file.tell()
+
+            # The run time is in the empty frame at the very end.
+            time = None
+            file.seek(0, 2)
+            if file.tell() - start >= FRAME.size + END.size:
+                file.seek(-(FRAME.size + END.size), 2)
+                trailer = file.read()
+                if FRAME.unpack(trailer[:FRAME.size]) == (0, END.size):
+                    time, = END.unpack(trailer[FRAME.size:])
+
+        super().__init__(timestamps = header["timestamps"])
+        self.path = path
+        self.codec: str = header["codec"]
+        self.codes: str = header["codes"]
+        self.names: list[str] = header["names"]
+        self.start = start
+        self.time: float | None = time
+        # Traces from before overheads were calibrated per event type hold a single overhead for every event.
+        overhead = header.get("overhead", 0.0)
+        self.overhead: list[float] = overhead if isinstance(overhead, list) else [overhead] * len(event_codes)
+        self.length: int | None = None
+
+    def chunk_columns(self) -> Iterator[Chunk]:
+        decompress = _decompressor(self.codec)
+        length = 0
+        with open(self.path, "rb") as file:
+            file.seek(self.start)
+            while header := file.read(FRAME.size):
+                if len(header) < FRAME.size:
+                    raise EOFError(f"{self.path} ends in the middle of a frame header.")
+                count, size = FRAME.unpack(header)
+                payload = file.read(size)
+                if len(payload) < size:
+                    raise EOFError(f"{self.path} ends in the middle of a frame.")
+
+                if count == 0:
+                    continue
+
+                data = memoryview(decompress(payload))
+                offsets = data[:4 * count].cast("I")
+                events = data[4 * count:5 * count].cast("B")
+                times = data[5 * count:13 * count].cast("Q") if self.timestamps else None
+                length += count
+                yield offsets, events, times
+
+        self.length = length
+
+    def __len__(self) -> int:
+        if self.length is None:
+            for _ in self.chunk_columns():
+                pass
+        return self.length
+
+    def append(self, offset: int, event: int, timestamp: int = 0) -> None:
+        raise TypeError("A saved trace is read-only.")
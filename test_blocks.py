@@ -0,0 +1,31 @@
+import sys, unittest
+from random import Random
+
+import sorting_algorithms
+from sorting_algorithms import algorithms
+from evaluator import Evaluator, categories
+
+def _counts(backend: str, function, array: list[int]) -> list[int]:
+    evaluator = Evaluator(backend)
+    evaluator.measure(function)(list(array))
+    evaluator.close()
+    return [evaluator[function.__name__][category] for category in categories]
+
+@unittest.skipUnless(hasattr(sys, "monitoring"), "block counting needs sys.monitoring")
+class BlockCountingTest(unittest.TestCase):
+    """Counting block entries and rebuilding the categories from them must give the same totals as counting every opcode."""
+
+    def test_blocks_match_opcodes(self) -> None:
+        generator = Random(0)
+        array = [generator.randint(0, 1_000) for _ in range(300)]
+        functions = [("bubble", "python", sorting_algorithms.bubble_sort)]
+        functions += [(name, backend, function) for name, info in algorithms.items() for backend, function in info["backends"].items()]
+
+        for name, backend, function in functions:
+            blocks = _counts("blocks", function, array)
+            for counting in ("monitoring", "settrace"):
+                with self.subTest(sort = name, backend = backend, counting = counting):
+                    self.assertEqual(blocks, _counts(counting, function, array))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import gc
+from typing import Callable, Iterable
+from time import perf_counter_ns
+from statistics import median
+from math import ceil, sqrt, erfc
+
+__all__ = "Timing", "summarise", "rank_sum", "autorange", "time_function"
+
+class Timing(object):
+    """Summary of a distribution of per-call times in nanoseconds."""
+    __slots__ = (
+        "samples",
+        "loops",
+        "median",
+        "mad",
+        "min",
+        "p95",
+        "outliers"
+    )
+
+    def __init__(self, samples: list[float], loops: int = 1) -> None:
+        self.samples = samples
+        self.loops = loops
+
+        if not samples:
+            self.median = self.mad = self.min = self.p95 = 0
+            self.outliers = []
+            return
+
+        ordered = sorted(samples)
+        self.median = median(ordered)
+        self.mad = median(abs(sample - self.median) for sample in ordered)
+        self.min = ordered[0]
+        self.p95 = ordered[min(len(ordered) - 1, ceil(0.95 * len(ordered)) - 1)]
+
+        # Samples further than three scaled MADs from the median, the robust analogue of three standard deviations.
+        limit = 3 * 1.4826 * self.mad
+        self.outliers = [sample for sample in samples if abs(sample - self.median) > limit] if limit else []
+
+    def __repr__(self) -> str:
+        return (
+            f"median {self.median / 1_000_000:.4f} ms ± {self.mad / 1_000_000:.4f} ms MAD, "
+            f"min {self.min / 1_000_000:.4f} ms, p95 {self.p95 / 1_000_000:.4f} ms, "
+            f"{len(self.outliers)} outliers in {len(self.samples)} samples of {self.loops} loops"
+        )
+
+def summarise(samples: Iterable[float], loops: int = 1) -> Timing:
+    return Timing(list(samples), loops)
+
+def rank_sum(first: Iterable[float], second: Iterable[float]) -> float:
+    """
+    Two-sided p-value of the Mann-Whitney U test that two samples come from the same distribution.
+    Uses the normal approximation with a tie correction, which makes no assumption about the shape of timing noise.
+    """
+    first, second = list(first), list(second)
+    n, m = len(first), len(second)
+    if not n or not m:
+        return 1.0
+
+    # Average ranks over the pooled samples, with tied values sharing the mean of their ranks.
+    pooled = sorted([(value, 0) for value in first] + [(value, 1) for value in second])
+    first_ranks = 0.0
+    ties = 0.0
+    i = 0
+    while i < len(pooled):
+        j = i
+        while j < len(pooled) and pooled[j][0] == pooled[i][0]:
+            j += 1
+        rank = (i + j + 1) / 2
+        first_ranks += rank * sum(1 for _, group in pooled[i:j] if group == 0)
+        ties += (j - i) ** 3 - (j - i)
+        i = j
+
+    u = first_ranks - n * (n + 1) / 2
+    total = n + m
+    variance = n * m / 12 * ((total + 1) - ties / (total * (total - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - n * m / 2) - 0.5) / sqrt(variance)
+    return min(1.0, erfc(max(z, 0) / sqrt(2)))
+
+def _run(function: Callable, data: object, loops: int, copy: Callable, disable_gc: bool) -> float:
+    # Copies are made before the timed region, so in-place sorts always get the original input.
+    inputs = [copy(data) for _ in range(loops)]
+
+    enabled = gc.isenabled()
+    if disable_gc:
+        gc.disable()
+    try:
+        start = perf_counter_ns()
+        for item in inputs:
+            function(item)
+        end = perf_counter_ns()
+    finally:
+        if disable_gc and enabled:
+            gc.enable()
+
+    return (end - start) / loops
+
+def autorange(function: Callable, data: object, minimum: float = 0.2, copy: Callable = list, disable_gc: bool = True) -> int:
+    """Find a number of loops, following 1, 2, 5, 10, 20, 50, ..., whose total run time is at least minimum seconds, like timeit.autorange."""
+    loops = 1
+    while True:
+        for multiplier in (1, 2, 5):
+            count = loops * multiplier
+            if _run(function, data, count, copy, disable_gc) * count >= minimum * 1_000_000_000:
+                return count
+        loops *= 10
+
+def time_function(
+        function: Callable,
+        data: object,
+        repeats: int = 7,
+        loops: int | None = None,
+        warmup: int = 1,
+        disable_gc: bool = True,
+        copy: Callable = list,
+        minimum: float = 0.2) -> Timing:
+    """
+    Time function(copy(data)) over several repeats and summarise the per-call times.
+    When loops is None it is calibrated with autorange, so every repeat runs for at least minimum seconds.
+    """
+    for _ in range(warmup):
+        function(copy(data))
+
+    if loops is None:
+        loops = autorange(function, data, minimum, copy, disable_gc)
+
+    return Timing([_run(function, data, loops, copy, disable_gc) for _ in range(repeats)], loops)
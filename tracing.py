@@ -0,0 +1,308 @@
+import sys
+from typing import Callable, Any
+from types import CodeType, FrameType
+from enum import StrEnum
+
+__all__ = "Event", "Backend", "SetTraceBackend", "MonitoringBackend", "get_backend", "backends", "trace_opcodes", "event_codes"
+
+class Event(StrEnum):
+    CALL = "call" # profile and trace
+    LINE = "line" # trace
+    RETURN = "return" # profile and trace
+    EXCEPTION = "exception" # trace
+    C_CALL = "c_call" # profile
+    C_RETURN = "c_return" # profile
+    C_EXCEPTION = "c_exception" # profile
+    OPCODE = "opcode" # trace
+    JUMP = "jump" # monitoring
+
+# Small integer code stored for each event instead of the event string.
+event_codes: dict[Event, int] = {event: code for code, event in enumerate(Event)}
+
+# An EventBuffer or a TraceWriter. Hooks append to its offsets, events and times columns directly, which stay the same arrays for its whole life,
+# and call its flush once the columns hold chunk_size events.
+type Buffer = Any
+
+class Backend(object):
+    """
+    Installs tracing hooks for a set of code objects and writes every event straight into a buffer as a flat offset and an event code.
+    The flat offset is the bytecode offset plus the base of the code object. Bases and event codes are worked out before tracing starts, so a hook only adds and appends.
+    Line, opcode and jump events can be switched on and off independently.
+    """
+    name: str = ""
+
+    def __init__(self, lines: bool = True, opcodes: bool = False, jumps: bool = False) -> None:
+        self.lines = lines
+        self.opcodes = opcodes
+        self.jumps = jumps
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def start(self, codes: set[CodeType], bases: dict[int, int], buffer: Buffer, clock: Callable[[], int] | None = None) -> None:
+        """Start tracing codes. bases maps the id of every code object to its base, and clock, when given, timestamps every event."""
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        raise NotImplementedError
+
+def trace_opcodes(frame: FrameType, armed: set[int]) -> None:
+    """
+    Turn on opcode events for a frame that already has a local trace function. Without the workarounds below they can silently stay off.
+    Setting f_trace_opcodes to True when it already is does nothing, and on 3.13 a code object that sys.monitoring instrumented since is not re-armed, so it is turned off first.
+    On 3.12 the flag only takes effect on a code object once tracing is set again, which is done the first time each code object in armed is seen.
+    """
+    frame.f_trace_opcodes = False
+    frame.f_trace_opcodes = True
+    if sys.version_info < (3, 13) and id(frame.f_code) not in armed:
+        armed.add(id(frame.f_code))
+        sys.settrace(sys.gettrace())
+
+class SetTraceBackend(Backend):
+    """Fallback backend built on sys.settrace. Only frames running one of the given code objects are traced."""
+    name = "settrace"
+
+    def __init__(self, lines: bool = True, opcodes: bool = False, jumps: bool = False) -> None:
+        if jumps:
+            raise ValueError("The settrace backend cannot report jump events.")
+        super().__init__(lines, opcodes, jumps)
+        self.previous = None
+
+    def start(self, codes: set[CodeType], bases: dict[int, int], buffer: Buffer, clock: Callable[[], int] | None = None) -> None:
+        lines = self.lines
+        opcodes = self.opcodes
+        offsets, size, flush = buffer.offsets, buffer.chunk_size, buffer.flush
+        put_offset, put_event, put_time = offsets.append, buffer.events.append, buffer.times.append if clock is not None else None
+        # settrace passes the event as a string, which hashes once and is then looked up at dict speed.
+        names = {str(event): code for event, code in event_codes.items()}
+        call = event_codes[Event.CALL]
+        armed: set[int] = set()
+
+        # Every traced frame gets its own local trace function with the base of its code object bound in.
+        def global_trace(frame: FrameType, event: str, arg: Any):
+            if frame.f_code not in codes:
+                return None
+            base = bases[id(frame.f_code)]
+
+            if clock is None:
+                def local_trace(frame: FrameType, event: str, arg: Any):
+                    put_offset(base + frame.f_lasti)
+                    put_event(names[event])
+                    if len(offsets) >= size:
+                        flush()
+                    return local_trace
+            else:
+                def local_trace(frame: FrameType, event: str, arg: Any):
+                    put_offset(base + frame.f_lasti)
+                    put_event(names[event])
+                    put_time(clock())
+                    if len(offsets) >= size:
+                        flush()
+                    return local_trace
+
+            # Opcode tracing only takes effect on frames that already have a local trace function.
+            frame.f_trace = local_trace
+            frame.f_trace_lines = lines
+            if opcodes:
+                trace_opcodes(frame, armed)
+            put_offset(base + frame.f_lasti)
+            put_event(call)
+            if clock is not None:
+                put_time(clock())
+            return local_trace
+
+        self.previous = sys.gettrace()
+        sys.settrace(global_trace)
+
+    def stop(self) -> None:
+        sys.settrace(self.previous)
+        self.previous = None
+
+class MonitoringBackend(Backend):
+    """
+    Backend built on PEP 669 sys.monitoring (Python 3.12+).
+    Events are enabled locally on the given code objects only, so the rest of the process runs at full speed.
+    """
+    name = "monitoring"
+    tool_name = "pyrftester"
+
+    def __init__(self, lines: bool = True, opcodes: bool = False, jumps: bool = False) -> None:
+        super().__init__(lines, opcodes, jumps)
+        self.tool_id: int | None = None
+        self.codes: set[CodeType] = set()
+
+    @classmethod
+    def available(cls) -> bool:
+        return hasattr(sys, "monitoring")
+
+    @staticmethod
+    def free_tool_id() -> int:
+        monitoring = sys.monitoring
+        # Prefer the profiler slot, but fall back to any slot not claimed by another tool.
+        for tool_id in (monitoring.PROFILER_ID, *range(6)):
+            if monitoring.get_tool(tool_id) is None:
+                return tool_id
+        raise RuntimeError("No free sys.monitoring tool ID is available.")
+
+    @property
+    def event_set(self) -> int:
+        events = sys.monitoring.events
+        event_set = events.PY_START | events.PY_RETURN | events.PY_YIELD | events.PY_RESUME
+        if self.lines:
+            event_set |= events.LINE
+        if self.opcodes:
+            event_set |= events.INSTRUCTION
+        # LINE events do not fire when a jump stays on the same line, so jumps are also needed to count lines like settrace does.
+        if self.lines or self.jumps:
+            event_set |= events.JUMP
+        return event_set
+
+    def start(self, codes: set[CodeType], bases: dict[int, int], buffer: Buffer, clock: Callable[[], int] | None = None) -> None:
+        monitoring = sys.monitoring
+        events = monitoring.events
+
+        self.tool_id = self.free_tool_id()
+        self.codes = set(codes)
+        monitoring.use_tool_id(self.tool_id, self.tool_name)
+
+        # Callbacks get the code object, and its base is looked up by id, since hashing a code object on every event is expensive.
+        # LINE callbacks only receive the line number, so each line is mapped straight to the flat offset of the first instruction that starts it.
+        # Jump callbacks receive offsets, so every offset is also mapped to its line.
+        line_offsets: dict[int, dict[int, int]] = {}
+        offset_lines: dict[int, dict[int, int | None]] = {}
+        for code in self.codes:
+            line_offsets[id(code)] = {}
+            offset_lines[id(code)] = {}
+            for start, end, line_number in code.co_lines():
+                offset_lines[id(code)].update(dict.fromkeys(range(start, end, 2), line_number))
+                if line_number is not None:
+                    line_offsets[id(code)].setdefault(line_number, bases[id(code)] + start)
+
+        offsets, size, flush = buffer.offsets, buffer.chunk_size, buffer.flush
+        put_offset, put_event, put_time = offsets.append, buffer.events.append, buffer.times.append if clock is not None else None
+
+        def hooks(event: int) -> tuple[Callable, Callable]:
+            """Callbacks for an event passed as (code, offset) and as (code, offset, argument), each a single Python call."""
+            if clock is None:
+                def hook(code: CodeType, offset: int) -> None:
+                    put_offset(bases[id(code)] + offset)
+                    put_event(event)
+                    if len(offsets) >= size:
+                        flush()
+
+                def hook_with_argument(code: CodeType, offset: int, argument: Any) -> None:
+                    put_offset(bases[id(code)] + offset)
+                    put_event(event)
+                    if len(offsets) >= size:
+                        flush()
+            else:
+                def hook(code: CodeType, offset: int) -> None:
+                    put_offset(bases[id(code)] + offset)
+                    put_event(event)
+                    put_time(clock())
+                    if len(offsets) >= size:
+                        flush()
+
+                def hook_with_argument(code: CodeType, offset: int, argument: Any) -> None:
+                    put_offset(bases[id(code)] + offset)
+                    put_event(event)
+                    put_time(clock())
+                    if len(offsets) >= size:
+                        flush()
+
+            return hook, hook_with_argument
+
+        on_start, on_call = hooks(event_codes[Event.CALL])
+        _, on_return = hooks(event_codes[Event.RETURN])
+        on_instruction, _ = hooks(event_codes[Event.OPCODE])
+        _, record_jump = hooks(event_codes[Event.JUMP])
+
+        line = event_codes[Event.LINE]
+        if clock is None:
+            def on_line(code: CodeType, line_number: int) -> None:
+                put_offset(line_offsets[id(code)][line_number])
+                put_event(line)
+                if len(offsets) >= size:
+                    flush()
+        else:
+            def on_line(code: CodeType, line_number: int) -> None:
+                put_offset(line_offsets[id(code)][line_number])
+                put_event(line)
+                put_time(clock())
+                if len(offsets) >= size:
+                    flush()
+
+        # settrace reports a line again when a backward jump lands on the line it left, as in a loop on a single line, which LINE events leave out.
+        if not self.lines:
+            on_jump = record_jump
+        elif self.jumps:
+            def on_jump(code: CodeType, offset: int, destination: int) -> None:
+                record_jump(code, offset, destination)
+                if destination <= offset:
+                    lines = offset_lines[id(code)]
+                    if lines[destination] == lines[offset] is not None:
+                        on_line(code, lines[destination])
+        else:
+            def on_jump(code: CodeType, offset: int, destination: int) -> None:
+                if destination <= offset:
+                    lines = offset_lines[id(code)]
+                    if lines[destination] == lines[offset] is not None:
+                        on_line(code, lines[destination])
+
+        # Like settrace, a frame left by an exception or a yield returns, and a generator resumed or thrown into is called again.
+        # Unwind and throw events can only be enabled for all code, so their callbacks skip frames that are not traced.
+        def on_unwind(code: CodeType, offset: int, exception: BaseException) -> None:
+            if id(code) in bases:
+                on_return(code, offset, exception)
+
+        def on_throw(code: CodeType, offset: int, exception: BaseException) -> None:
+            if id(code) in bases:
+                on_call(code, offset, exception)
+
+        monitoring.register_callback(self.tool_id, events.PY_START, on_start)
+        monitoring.register_callback(self.tool_id, events.PY_RESUME, on_start)
+        monitoring.register_callback(self.tool_id, events.PY_RETURN, on_return)
+        monitoring.register_callback(self.tool_id, events.PY_YIELD, on_return)
+        monitoring.register_callback(self.tool_id, events.PY_UNWIND, on_unwind)
+        monitoring.register_callback(self.tool_id, events.PY_THROW, on_throw)
+        monitoring.register_callback(self.tool_id, events.LINE, on_line)
+        monitoring.register_callback(self.tool_id, events.INSTRUCTION, on_instruction)
+        monitoring.register_callback(self.tool_id, events.JUMP, on_jump)
+
+        event_set = self.event_set
+        for code in self.codes:
+            monitoring.set_local_events(self.tool_id, code, event_set)
+        monitoring.set_events(self.tool_id, events.PY_UNWIND | events.PY_THROW)
+
+    def stop(self) -> None:
+        if self.tool_id is None:
+            return
+        monitoring = sys.monitoring
+        events = monitoring.events
+
+        monitoring.set_events(self.tool_id, events.NO_EVENTS)
+        for code in self.codes:
+            monitoring.set_local_events(self.tool_id, code, events.NO_EVENTS)
+        for event in (events.PY_START, events.PY_RESUME, events.PY_RETURN, events.PY_YIELD, events.PY_UNWIND, events.PY_THROW, events.LINE, events.INSTRUCTION, events.JUMP):
+            monitoring.register_callback(self.tool_id, event, None)
+        monitoring.free_tool_id(self.tool_id)
+
+        self.tool_id = None
+        self.codes = set()
+
+backends: dict[str, type[Backend]] = {
+    SetTraceBackend.name: SetTraceBackend,
+    MonitoringBackend.name: MonitoringBackend
+}
+
+def get_backend(backend: str | Backend = "auto", lines: bool = True, opcodes: bool = False, jumps: bool = False) -> Backend:
+    if isinstance(backend, Backend):
+        return backend
+    if backend == "auto":
+        backend = MonitoringBackend.name if MonitoringBackend.available() else SetTraceBackend.name
+    if backend not in backends:
+        raise KeyError(f"{backend} is not a known tracing backend. Choose from {", ".join(backends)}.")
+    if not backends[backend].available():
+        raise RuntimeError(f"The {backend} backend is not available on Python {sys.version.split()[0]}.")
+    return backends[backend](lines, opcodes, jumps)